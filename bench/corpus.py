@@ -0,0 +1,253 @@
+"""Generate synthetic changelog corpora for benchmarking.
+
+A corpus is a small Sphinx project: a ``conf.py`` that enables the
+extension, an ``index.rst`` with a toctree, one or more changelog files,
+and a directory of change fragments pulled into the newest version of
+the first changelog file with ``:include_notes_from:``::
+
+    python bench/corpus.py /tmp/corpus --versions 20 --changes 100
+
+"""
+import argparse
+import os
+import random
+
+COMPONENTS = [
+    "orm",
+    "sql",
+    "engine",
+    "schema",
+    "postgresql",
+    "mysql",
+    "sqlite",
+    "oracle",
+    "mssql",
+    "asyncio",
+    "declarative",
+    "ext",
+]
+KINDS = ["bug", "feature", "usecase", "change", "performance"]
+
+NOTES_DIR = "unreleased"
+
+
+class CorpusParams(object):
+    """Parameters for :func:`.write_corpus`.
+
+    :param files: number of changelog files; each one gets its own series
+     of versions.
+    :param versions: number of released versions per changelog file.
+    :param changes: number of changes per version.
+    :param fragments: number of fragment files for the unreleased version.
+    :param backport_pct: share of changes that also apply to older
+     versions through ``:versions:``.
+    :param backport_fanout: the most older versions a backported change
+     applies to.
+    :param tags: number of distinct component tags.
+    :param tickets: number of distinct ticket numbers.
+    :param seed: random seed; the same parameters always produce the same
+     corpus.
+
+    """
+
+    def __init__(
+        self,
+        files=1,
+        versions=10,
+        changes=100,
+        fragments=50,
+        backport_pct=0.3,
+        backport_fanout=3,
+        tags=7,
+        tickets=5000,
+        seed=42,
+    ):
+        self.files = files
+        self.versions = versions
+        self.changes = changes
+        self.fragments = fragments
+        self.backport_pct = backport_pct
+        self.backport_fanout = backport_fanout
+        self.tags = tags
+        self.tickets = tickets
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        defaults = cls()
+        for name, help_ in [
+            ("files", "number of changelog files"),
+            ("versions", "released versions per changelog file"),
+            ("changes", "changes per version"),
+            ("fragments", "fragment files for the unreleased version"),
+            ("backport-fanout", "most older versions a change applies to"),
+            ("tags", "number of distinct component tags"),
+            ("tickets", "number of distinct ticket numbers"),
+            ("seed", "random seed"),
+        ]:
+            parser.add_argument(
+                "--" + name,
+                type=int,
+                default=getattr(defaults, name.replace("-", "_")),
+                help=help_ + " (default: %(default)s)",
+            )
+        parser.add_argument(
+            "--backport-pct",
+            type=float,
+            default=defaults.backport_pct,
+            help="share of changes that are backported "
+            "(default: %(default)s)",
+        )
+
+    @classmethod
+    def from_options(cls, options):
+        return cls(
+            **{
+                name: getattr(options, name)
+                for name in cls().as_dict()
+                if hasattr(options, name)
+            }
+        )
+
+
+def component_tags(count):
+    return [
+        COMPONENTS[i] if i < len(COMPONENTS) else "component%d" % i
+        for i in range(count)
+    ]
+
+
+def write_corpus(directory, params):
+    """Write a corpus into ``directory``.
+
+    Returns the paths of the changelog files written, in order.
+
+    """
+    rand = random.Random(params.seed)
+    tags = component_tags(params.tags)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(os.path.join(directory, "conf.py"), "w") as handle:
+        handle.write(
+            'project = "changelog benchmark"\n'
+            'master_doc = "index"\n'
+            'extensions = ["changelog"]\n'
+            "changelog_sections = %r\n"
+            "changelog_inner_tag_sort = %r\n"
+            'changelog_render_ticket = "https://example.com/ticket/%%s"\n'
+            'changelog_render_pullreq = "https://example.com/pr/%%s"\n'
+            'changelog_render_changeset = "https://example.com/cs/%%s"\n'
+            # the fragments are included by the changelog, not documents
+            # of their own
+            "exclude_patterns = %r\n"
+            % (["general"] + tags[:6], KINDS, [NOTES_DIR])
+        )
+
+    names = ["changelog_%d" % num for num in range(1, params.files + 1)]
+    with open(os.path.join(directory, "index.rst"), "w") as handle:
+        handle.write("=====\nIndex\n=====\n\n.. toctree::\n\n")
+        for name in names:
+            handle.write("    %s\n" % name)
+
+    filenames = []
+    for num, name in enumerate(names, 1):
+        filename = os.path.join(directory, name + ".rst")
+        with open(filename, "w") as handle:
+            write_changelog(
+                handle,
+                rand,
+                params,
+                tags,
+                major=num,
+                notes_dir=NOTES_DIR if num == 1 else None,
+            )
+        filenames.append(filename)
+
+    if params.fragments:
+        notes_dir = os.path.join(directory, NOTES_DIR)
+        if not os.path.exists(notes_dir):
+            os.makedirs(notes_dir)
+        for num in range(params.fragments):
+            with open(
+                os.path.join(notes_dir, "%05d.rst" % num), "w"
+            ) as handle:
+                write_change(handle, rand, params, tags, indent="")
+
+    return filenames
+
+
+def write_changelog(handle, rand, params, tags, major=1, notes_dir=None):
+    """Write one changelog file of ``params.versions`` versions."""
+
+    versions = [
+        "%d.%d.0" % (major, params.versions - i)
+        for i in range(params.versions)
+    ]
+    handle.write("=============\nChangelog %d\n=============\n\n" % major)
+    if notes_dir and params.fragments:
+        handle.write(
+            ".. changelog::\n    :version: %d.%d.0\n"
+            "    :include_notes_from: %s\n\n"
+            % (major, params.versions + 1, notes_dir)
+        )
+    for idx, version in enumerate(versions):
+        handle.write(
+            ".. changelog::\n    :version: %s\n    :released: "
+            "Jan 1 2020\n\n" % version
+        )
+        older = versions[idx + 1 : idx + 1 + params.backport_fanout]
+        for _ in range(params.changes):
+            write_change(
+                handle,
+                rand,
+                params,
+                tags,
+                backport_to=older
+                if older and rand.random() < params.backport_pct
+                else None,
+            )
+
+
+def write_change(handle, rand, params, tags, backport_to=None, indent="    "):
+    ticket = rand.randrange(1000, 1000 + params.tickets)
+    lines = [
+        ".. change::",
+        "    :tags: %s, %s" % (rand.choice(tags), rand.choice(KINDS)),
+        "    :tickets: %d" % ticket,
+    ]
+    if backport_to:
+        lines.append(
+            "    :versions: %s"
+            % ", ".join(backport_to[: rand.randint(1, len(backport_to))])
+        )
+    lines.extend(
+        [
+            "",
+            "    Fixed issue where :class:`.Thing` would ``frobnicate`` the",
+            "    widget when %s was set, see :ticket:`%d`."
+            % (rand.choice(["a", "b", "c"]) * rand.randint(1, 8), ticket),
+            "",
+        ]
+    )
+    for line in lines:
+        handle.write((indent + line).rstrip() + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("directory", help="directory to write the corpus to")
+    CorpusParams.add_arguments(parser)
+    options = parser.parse_args(argv)
+    for filename in write_corpus(
+        options.directory, CorpusParams.from_options(options)
+    ):
+        print(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure the import time of the command line tool.
+
+Runs ``python -X importtime`` in fresh processes and reports the median
+cumulative import time of each module given, along with which of Sphinx
+and docutils ended up imported::
+
+    python bench/import_time.py changelog.cmd changelog.mdwriter
+
+With no arguments, compares ``changelog.cmd``, which is all that a
+``release-notes`` run imports, against the markdown writer and the Sphinx
+extension; the package used to import the latter unconditionally.
+
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+DEFAULT_MODULES = [
+    "changelog.cmd",
+    "changelog.mdwriter",
+    "changelog.sphinxext",
+]
+
+
+def import_time(module, runs):
+    """Return ``(median microseconds, heavy packages imported)``."""
+
+    code = (
+        "import sys, %s; "
+        "sys.stdout.write(' '.join(m for m in ('sphinx', 'docutils') "
+        "if m in sys.modules))" % module
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+    timings = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            check=True,
+            universal_newlines=True,
+        )
+        for line in proc.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                timings.append(int(fields[1]))
+                break
+        heavy = proc.stdout.split()
+    return statistics.median(timings), heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=7,
+        help="processes per module (default: %(default)s)",
+    )
+    options = parser.parse_args(argv)
+
+    print("%-24s %10s  %s" % ("module", "median ms", "imports"))
+    for module in options.modules:
+        median, heavy = import_time(module, options.runs)
+        print(
+            "%-24s %10.1f  %s"
+            % (module, median / 1000.0, ", ".join(heavy) or "-")
+        )
+
+
+if __name__ == "__main__":
+    main()
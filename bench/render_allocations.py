@@ -0,0 +1,72 @@
+"""Measure memory allocated while rendering a large changelog to markdown.
+
+Generates a changelog of several thousand changes, a share of which are
+backported to several versions, and renders it with the markdown writer
+under tracemalloc::
+
+    python bench/render_allocations.py --changes 3000
+
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import corpus  # noqa
+from changelog import mdwriter  # noqa
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--versions", type=int, default=10)
+    parser.add_argument("--changes", type=int, default=3000)
+    parser.add_argument("--backport-pct", type=float, default=0.3)
+    options = parser.parse_args(argv)
+
+    per_version = max(1, options.changes // options.versions)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "changelog.rst")
+        with open(filename, "w") as handle:
+            params = corpus.CorpusParams(
+                versions=options.versions,
+                changes=per_version,
+                fragments=0,
+                backport_pct=options.backport_pct,
+            )
+            corpus.write_changelog(
+                handle,
+                random.Random(params.seed),
+                params,
+                corpus.component_tags(params.tags),
+            )
+
+        sections = []
+        tracemalloc.start()
+        now = time.perf_counter()
+        mdwriter.stream_changelog_sections(
+            filename, None, lambda version, text: sections.append(version)
+        )
+        elapsed = time.perf_counter() - now
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(
+        "%d changes over %d versions rendered in %.2fs; "
+        "peak traced memory %.1f MB"
+        % (
+            per_version * options.versions,
+            len(sections),
+            elapsed,
+            peak / 1024.0 / 1024.0,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Time the main changelog operations against a synthetic corpus.
+
+Generates a corpus with :mod:`corpus`, then times a Sphinx build (serial
+and with ``-j``), ``generate-md``, ``stream_changelog_sections()`` and
+``release-notes`` against it.  Each measurement runs in a fresh process so
+that caches don't carry over between runs; the best of ``--repeat`` timed
+runs is reported, and peak memory comes from one more run under
+tracemalloc (for ``sphinx-jN``, that of the main process only)::
+
+    python bench/run_benchmarks.py --versions 20 --changes 200 \\
+        --save-baseline baseline.json
+
+    python bench/run_benchmarks.py --versions 20 --changes 200 \\
+        --compare baseline.json
+
+With ``--compare``, exits non-zero if any benchmark got slower, or used
+more memory, than the baseline by more than ``--tolerance``.
+
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import corpus  # noqa
+
+BENCHMARKS = ["sphinx", "sphinx-jN", "generate-md", "stream", "release-notes"]
+
+
+def bench_sphinx(corpus_dir, workdir, jobs):
+    from sphinx.cmd.build import build_main
+
+    argv = [
+        "-q",
+        "-E",
+        "-b",
+        "html",
+        "-d",
+        os.path.join(workdir, "doctrees"),
+        corpus_dir,
+        os.path.join(workdir, "html"),
+    ]
+    if jobs > 1:
+        argv[:0] = ["-j", str(jobs)]
+
+    def run():
+        status = build_main(argv)
+        if status:
+            raise RuntimeError("sphinx-build exited with %s" % status)
+
+    return run
+
+
+def bench_generate_md(corpus_dir, workdir, jobs):
+    from changelog import mdwriter
+
+    def run():
+        status = mdwriter.render_changelogs_as_md(
+            _changelog_files(corpus_dir),
+            os.path.join(corpus_dir, "conf.py"),
+            os.path.join(workdir, "md"),
+            None,
+            False,
+        )
+        if status:
+            raise RuntimeError("generate-md failed to render some files")
+
+    return run
+
+
+def bench_stream(corpus_dir, workdir, jobs):
+    from changelog import mdwriter
+
+    def run():
+        for filename in _changelog_files(corpus_dir):
+            mdwriter.stream_changelog_sections(
+                filename,
+                os.path.join(corpus_dir, "conf.py"),
+                lambda version, text: None,
+            )
+
+    return run
+
+
+def bench_release_notes(corpus_dir, workdir, jobs):
+    from changelog import cmd
+
+    # work on a copy, as the fragments are consumed
+    copy_dir = os.path.join(workdir, "corpus")
+    shutil.copytree(corpus_dir, copy_dir)
+    filename = _changelog_files(copy_dir)[0]
+    with open(filename) as handle:
+        for line in handle:
+            if ":version:" in line:
+                version = line.split(":version:")[1].strip()
+                break
+
+    def run():
+        cmd.release_notes_into_changelog_file(
+            filename, version, "Jan 1 2021", git=False
+        )
+
+    return run
+
+
+_SETUPS = {
+    "sphinx": lambda corpus_dir, workdir, jobs: bench_sphinx(
+        corpus_dir, workdir, 1
+    ),
+    "sphinx-jN": bench_sphinx,
+    "generate-md": bench_generate_md,
+    "stream": bench_stream,
+    "release-notes": bench_release_notes,
+}
+
+
+def _changelog_files(corpus_dir):
+    return sorted(
+        os.path.join(corpus_dir, fname)
+        for fname in os.listdir(corpus_dir)
+        if fname.startswith("changelog_") and fname.endswith(".rst")
+    )
+
+
+def run_child(name, corpus_dir, jobs, measure_memory):
+    """Run one benchmark once, in this process, returning its numbers."""
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run = _SETUPS[name](corpus_dir, workdir, jobs)
+
+        # keep progress output and warnings from the code being measured
+        # out of the results
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = io.StringIO()
+        try:
+            if measure_memory:
+                tracemalloc.start()
+            now = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - now
+            if measure_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    if measure_memory:
+        return {"peak_mb": peak / 1024.0 / 1024.0}
+    else:
+        return {"seconds": elapsed}
+
+
+def _spawn(name, corpus_dir, jobs, measure_memory):
+    argv = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        name,
+        "--corpus",
+        corpus_dir,
+        "--jobs",
+        str(jobs),
+    ]
+    if measure_memory:
+        argv.append("--memory")
+    output = subprocess.check_output(argv)
+    return json.loads(output.decode("utf-8"))
+
+
+def run_benchmarks(corpus_dir, names, repeat, jobs):
+    results = {}
+    for name in names:
+        seconds = min(
+            _spawn(name, corpus_dir, jobs, False)["seconds"]
+            for _ in range(repeat)
+        )
+        peak_mb = _spawn(name, corpus_dir, jobs, True)["peak_mb"]
+        results[name] = {"seconds": seconds, "peak_mb": peak_mb}
+        sys.stderr.write("%-14s %8.3fs %9.1f MB\n" % (name, seconds, peak_mb))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print a comparison against a baseline; return the regression count."""
+
+    regressions = 0
+    print(
+        "%-14s %10s %10s %7s %10s %10s %7s"
+        % (
+            "benchmark",
+            "base s",
+            "now s",
+            "ratio",
+            "base MB",
+            "now MB",
+            "ratio",
+        )
+    )
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print("%-14s (not in baseline)" % name)
+            continue
+        time_ratio = result["seconds"] / base["seconds"]
+        mem_ratio = result["peak_mb"] / base["peak_mb"]
+        flag = ""
+        if time_ratio > 1 + tolerance or mem_ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            "%-14s %10.3f %10.3f %7.2f %10.1f %10.1f %7.2f%s"
+            % (
+                name,
+                base["seconds"],
+                result["seconds"],
+                time_ratio,
+                base["peak_mb"],
+                result["peak_mb"],
+                mem_ratio,
+                flag,
+            )
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    corpus.CorpusParams.add_arguments(parser)
+    parser.add_argument(
+        "--bench",
+        action="append",
+        choices=BENCHMARKS,
+        help="benchmark to run; may be given more than once (default: all)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="timed runs per benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 2,
+        help="processes for sphinx-jN (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--corpus",
+        help="use or create the corpus in this directory rather than a "
+        "temporary one",
+    )
+    parser.add_argument(
+        "--save-baseline", metavar="FILE", help="write results to FILE"
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="compare results with FILE"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown / memory growth against the baseline "
+        "(default: %(default)s)",
+    )
+    parser.add_argument("--child", choices=BENCHMARKS, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--memory", action="store_true", help=argparse.SUPPRESS
+    )
+    options = parser.parse_args(argv)
+
+    if options.child:
+        json.dump(
+            run_child(
+                options.child, options.corpus, options.jobs, options.memory
+            ),
+            sys.stdout,
+        )
+        return 0
+
+    params = corpus.CorpusParams.from_options(options)
+    names = options.bench or BENCHMARKS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = options.corpus or os.path.join(tmp, "corpus")
+        if not os.path.exists(os.path.join(corpus_dir, "conf.py")):
+            corpus.write_corpus(corpus_dir, params)
+        results = run_benchmarks(
+            corpus_dir, names, options.repeat, options.jobs
+        )
+
+    document = {
+        "params": params.as_dict(),
+        "jobs": options.jobs,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+    if options.save_baseline:
+        with open(options.save_baseline, "w") as handle:
+            json.dump(document, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+
+    if options.compare:
+        with open(options.compare) as handle:
+            baseline = json.load(handle)
+        if baseline["params"] != document["params"]:
+            sys.stderr.write(
+                "warning: baseline was recorded with different corpus "
+                "parameters: %s\n" % baseline["params"]
+            )
+        if compare(results, baseline["results"], options.tolerance):
+            return 1
+    elif not options.save_baseline:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,9 @@
 __version__ = "0.5.5"
 
-from .sphinxext import setup  # noqa
+
+def setup(app):
+    # imported here so that the docutils-only parts of the package, such
+    # as the markdown writer and the exporter, don't require Sphinx
+    from .sphinxext import setup
+
+    return setup(app)
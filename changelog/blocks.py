@@ -0,0 +1,164 @@
+"""Locate the ``.. changelog::`` blocks of a changelog file without docutils.
+
+Only top-level directives are found, which is where changelog files put
+them.  Each block runs from the directive line up to the next line that
+isn't blank or indented, not counting the blank lines before it.
+
+"""
+import os
+import re
+
+from .cache import list_note_files
+
+_CHANGELOG_DIRECTIVE = re.compile(r"\.\. +changelog:: *$")
+_OPTION = re.compile(r" *:(.+?):(?: +(.+))?$")
+_VERSIONS_OPTION = re.compile(r"^ *:versions: +(.+?) *$", re.M)
+
+
+class VersionBlock(object):
+    """The source lines of one ``.. changelog::`` directive.
+
+    ``start`` and ``end`` are the zero-based line numbers of the block
+    within the file, ``end`` being exclusive.
+
+    """
+
+    __slots__ = ("version", "start", "end", "lines", "options")
+
+    def __init__(self, start, end, lines):
+        self.start = start
+        self.end = end
+        self.lines = lines
+        self.options = _leading_options(lines[1:])
+        self.version = self.options.get("version", "")
+
+    @property
+    def text(self):
+        return "".join(self.lines)
+
+    @property
+    def notes_dir(self):
+        return self.options.get("include_notes_from")
+
+    def read_notes(self, base_dir):
+        """Return ``(path, [(fname, content), ...])`` for the notes
+        directory of the block, ``content`` being bytes.
+
+        ``path`` is None if the block doesn't include notes.
+
+        """
+        if self.notes_dir is None:
+            return None, []
+        path = os.path.abspath(os.path.join(base_dir, self.notes_dir))
+        fnames = list_note_files(path)
+        if fnames is None:
+            # reported when the file is parsed
+            return path, []
+        notes = []
+        for fname in fnames:
+            with open(os.path.join(path, fname), "rb") as handle:
+                notes.append((fname, handle.read()))
+        return path, notes
+
+    def mentioned_versions(self, notes):
+        """Return the versions named by ``:versions:`` options in the
+        block or in its notes, as returned by :meth:`.read_notes`."""
+
+        versions = mentioned_versions(self.text)
+        for fname, content in notes:
+            versions.update(
+                mentioned_versions(content.decode("utf-8", "replace"))
+            )
+        return versions
+
+    def __repr__(self):
+        return "VersionBlock(%r, %d, %d)" % (
+            self.version,
+            self.start,
+            self.end,
+        )
+
+
+def _leading_options(lines):
+    # the same options that docutils._parse_content() picks up
+    options = {}
+    lines = [line.rstrip() for line in lines]
+    while lines and not lines[0]:
+        lines.pop(0)
+    for idx, line in enumerate(lines):
+        m = _OPTION.match(line)
+        if m:
+            options[m.group(1)] = m.group(2) or ""
+        elif idx == 0 and line:
+            continue
+        else:
+            break
+    return options
+
+
+def split_version_blocks(text):
+    """Return ``(blocks, lines)`` for the text of a changelog file.
+
+    ``blocks`` is the list of :class:`.VersionBlock` in document order;
+    ``lines`` is the list of all lines of the file, with line endings,
+    split as docutils splits them.
+
+    """
+    if "\v" in text or "\f" in text:
+        # docutils makes these spaces before splitting lines
+        text = text.replace("\v", " ").replace("\f", " ")
+    lines = text.splitlines(True)
+    blocks = []
+    idx = 0
+    while idx < len(lines):
+        if not _CHANGELOG_DIRECTIVE.match(lines[idx].rstrip("\r\n")):
+            idx += 1
+            continue
+        start = end = idx
+        idx += 1
+        while idx < len(lines) and (
+            not lines[idx].strip() or lines[idx][0] in " \t"
+        ):
+            if lines[idx].strip():
+                end = idx
+            idx += 1
+        blocks.append(VersionBlock(start, end + 1, lines[start : end + 1]))
+        idx = end + 1
+    return blocks, lines
+
+
+def mentioned_versions(text):
+    """Return the set of versions named by ``:versions:`` options."""
+
+    versions = set()
+    for value in _VERSIONS_OPTION.findall(text):
+        versions.update(
+            version for version in re.split(r"\s*,\s*", value) if version
+        )
+    return versions
+
+
+def version_line_ranges(blocks, line_count, versions, base_dir):
+    """Return the ``(start, end)`` line ranges needed to render ``versions``.
+
+    These are everything outside of the ``.. changelog::`` blocks, which
+    includes any ``.. changelog_imports::``, the blocks of the versions
+    themselves and the blocks with changes naming one of them in a
+    ``:versions:`` option.  Other blocks are left out.
+
+    """
+    versions = set(versions)
+    ranges = []
+    pos = 0
+    for block in blocks:
+        if block.version in versions:
+            continue
+        path, notes = block.read_notes(base_dir)
+        if versions.intersection(block.mentioned_versions(notes)):
+            continue
+        if pos < block.start:
+            ranges.append((pos, block.start))
+        pos = block.end
+    if pos < line_count:
+        ranges.append((pos, line_count))
+    return ranges
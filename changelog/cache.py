@@ -0,0 +1,482 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
+import docutils
+from docutils import nodes
+
+# bump this when the layout of what's stored in the cache changes
+CACHE_FORMAT = 2
+
+
+def config_key(env):
+    """Return a string identifying the configuration that affects parsing.
+
+    The rendering of tickets, pull requests and changesets is baked into the
+    parsed nodes, so any change to the ``changelog_*`` settings invalidates
+    the cache.
+
+    """
+    return repr(
+        (
+            CACHE_FORMAT,
+            docutils.__version__,
+            env.changelog_sections,
+            env.changelog_inner_tag_sort,
+            env.changelog_hide_sections_from_tags,
+            env.changelog_render_ticket,
+            env.changelog_render_pullreq,
+            env.changelog_render_changeset,
+        )
+    )
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class NotesCache(object):
+    """Persistent cache of parsed change records for a notes directory.
+
+    One pickle file is kept per ``:include_notes_from:`` directory.  It maps
+    each fragment filename to the ``(size, mtime, content hash, has tabs)``
+    seen when it was last read, and each content hash to the list of parsed
+    changes that fragment produced.  Fragments whose stat info is unchanged
+    are served without being opened; fragments whose stat info changed are
+    re-read and only re-parsed if their content hash is new.
+
+    Changes whose bodies refer to other nodes of their document, such as
+    through named hyperlink targets, are not kept; a fragment producing
+    any of those is parsed again on each build.
+
+    """
+
+    def __init__(self, cache_dir, notes_dir, config):
+        self.notes_dir = os.path.abspath(notes_dir)
+        self.filename = os.path.join(
+            cache_dir,
+            "notes-%s.pickle"
+            % hashlib.sha1(self.notes_dir.encode("utf-8")).hexdigest(),
+        )
+        self.config = config
+        self.files = {}
+        self.parsed = {}
+        self._seen = set()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, "rb") as handle:
+                data = pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return
+        if data.get("config") != self.config:
+            return
+        self.files = data["files"]
+        self.parsed = data["parsed"]
+
+    def digest_for(self, fname, stat):
+        """Return ``(content hash, has tabs)`` for a file if its stat info
+        is unchanged.
+
+        Returns None if the file is new or has been modified.
+
+        """
+        entry = self.files.get(fname)
+        if entry is not None and entry[0:2] == (stat.st_size, stat.st_mtime):
+            self._seen.add(fname)
+            return entry[2:4]
+        return None
+
+    def note_file(self, fname, stat, digest, has_tabs):
+        self._seen.add(fname)
+        self.files[fname] = (stat.st_size, stat.st_mtime, digest, has_tabs)
+        self._dirty = True
+
+    def has(self, digest):
+        """Return True if there are parsed changes for a content hash."""
+
+        return self.parsed.get(digest) is not None
+
+    def get(self, digest):
+        """Return the list of parsed changes for a content hash, or None."""
+
+        data = self.parsed.get(digest)
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def put(self, digest, changes):
+        if any(needs_document(change["node"]) for change in changes):
+            if digest in self.parsed and self.parsed[digest] is None:
+                return
+            data = None
+        else:
+            data = pickle.dumps(
+                [detached_change(change) for change in changes],
+                pickle.HIGHEST_PROTOCOL,
+            )
+        self.parsed[digest] = data
+        self._dirty = True
+
+    def save(self):
+        """Write the cache back out, dropping entries for removed files."""
+
+        for fname in set(self.files).difference(self._seen):
+            del self.files[fname]
+            self._dirty = True
+
+        live = set(entry[2] for entry in self.files.values())
+        for digest in set(self.parsed).difference(live):
+            del self.parsed[digest]
+            self._dirty = True
+
+        if not self._dirty:
+            return
+
+        cache_dir = os.path.dirname(self.filename)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # write to a temp file in the same directory and rename it into
+        # place, so that concurrent builds never see a partial file
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                pickle.dump(
+                    {
+                        "config": self.config,
+                        "files": self.files,
+                        "parsed": self.parsed,
+                    },
+                    handle,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmpname, self.filename)
+        except:  # noqa
+            os.unlink(tmpname)
+            raise
+        self._dirty = False
+
+
+class SectionCache(object):
+    """Persistent cache of the markdown rendered per version of a file.
+
+    One pickle file is kept per changelog file, holding the markdown of
+    each version section under a key that hashes the configuration, the
+    text of the file outside of its ``.. changelog::`` blocks, the
+    version's own block along with the notes files it includes, and the
+    blocks naming the version in a ``:versions:`` option.  The files
+    included by ``.. changelog_imports::`` are checked by content hash
+    and invalidate every section when they change.
+
+    Keys are computed from the source text alone, so that when all of
+    the versions wanted are current the file needn't be parsed at all.
+
+    """
+
+    def __init__(self, cache_dir, target_filename, config, blocks, lines):
+        self.target_filename = os.path.abspath(target_filename)
+        self.filename = os.path.join(
+            cache_dir,
+            "sections-%s.pickle"
+            % hashlib.sha1(self.target_filename.encode("utf-8")).hexdigest(),
+        )
+        self.versions = [block.version for block in blocks]
+        self._base, self.keys, self.notes_dirs = section_keys(
+            config, blocks, lines, os.path.dirname(target_filename)
+        )
+        self.sections = {}
+        self.dependencies = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, "rb") as handle:
+                data = pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return
+        if data.get("base") != self._base:
+            return
+        for path, digest in data["dependencies"].items():
+            if dependency_digest(path) != digest:
+                return
+        self.dependencies = data["dependencies"]
+        self.sections = data["sections"]
+
+    def get(self, version):
+        """Return the cached markdown for a version, or None."""
+
+        key = self.keys.get(version)
+        entry = self.sections.get(version)
+        if key is None or entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def put(self, version, text):
+        key = self.keys.get(version)
+        if key is not None:
+            self.sections[version] = (key, text)
+            self._dirty = True
+
+    def save(self, dependencies):
+        """Write the cache back out.
+
+        ``dependencies`` are the files and notes directories read while
+        parsing the file, apart from the file itself and the notes
+        directories of its own blocks.
+
+        """
+        digests = {}
+        for path in dependencies:
+            path = os.path.abspath(path)
+            if path != self.target_filename and path not in self.notes_dirs:
+                digests[path] = dependency_digest(path)
+        if digests != self.dependencies:
+            self.dependencies = digests
+            self._dirty = True
+
+        versions = set(self.versions)
+        for version in set(self.sections).difference(versions):
+            del self.sections[version]
+            self._dirty = True
+
+        if not self._dirty:
+            return
+
+        cache_dir = os.path.dirname(self.filename)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                pickle.dump(
+                    {
+                        "base": self._base,
+                        "dependencies": self.dependencies,
+                        "sections": self.sections,
+                    },
+                    handle,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmpname, self.filename)
+        except:  # noqa
+            os.unlink(tmpname)
+            raise
+        self._dirty = False
+
+
+def section_keys(config, blocks, lines, base_dir):
+    """Return ``(base key, {version: key}, notes directories)`` for the
+    version blocks of a changelog file, as used by :class:`.SectionCache`.
+
+    A version's key changes whenever anything that may change how its
+    section renders does.  Versions with more than one section get no key.
+
+    """
+    notes_dirs = set()
+    outside = []
+    block_keys = []
+    mentioned_by = collections.defaultdict(list)
+    pos = 0
+    for block in blocks:
+        # a placeholder for each block, so that reordering the blocks
+        # or changing their versions changes the outside text
+        outside.extend(lines[pos : block.start])
+        outside.append("\0%s\n" % block.version)
+        pos = block.end
+
+        block_hash = hashlib.sha1(block.text.encode("utf-8"))
+        path, notes = block.read_notes(base_dir)
+        if path is not None:
+            notes_dirs.add(path)
+        for fname, content in notes:
+            block_hash.update(
+                (
+                    "\0%s\0%s" % (fname, hashlib.sha1(content).hexdigest())
+                ).encode("utf-8")
+            )
+        mentioned = block.mentioned_versions(notes)
+        block_key = block_hash.hexdigest()
+        block_keys.append(block_key)
+        for version in mentioned:
+            mentioned_by[version].append(block_key)
+    outside.extend(lines[pos:])
+
+    base = content_hash(config + "\0" + "".join(outside))
+    keys = {}
+    counts = collections.Counter(block.version for block in blocks)
+    for block, block_key in zip(blocks, block_keys):
+        if counts[block.version] > 1:
+            # a version with more than one section isn't cached
+            continue
+        keys[block.version] = content_hash(
+            "\0".join(
+                [base, block_key]
+                + sorted(
+                    key
+                    for key in mentioned_by[block.version]
+                    if key != block_key
+                )
+            )
+        )
+    return base, keys, notes_dirs
+
+
+def dependency_digest(path):
+    """Return a content hash for a file, or for a notes directory, of the
+    names and contents of its ``.rst`` files.
+
+    Returns None if the path doesn't exist.
+
+    """
+    if os.path.isdir(path):
+        fnames = list_note_files(path)
+        if fnames is None:
+            return None
+        return content_hash(
+            "\0".join(
+                "%s\0%s" % (fname, _file_digest(os.path.join(path, fname)))
+                for fname in fnames
+            )
+        )
+    return _file_digest(path)
+
+
+def _file_digest(path):
+    try:
+        with open(path, "rb") as handle:
+            return hashlib.sha1(handle.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+class ImportedChanges(object):
+    """The result of parsing a ``.. changelog_imports::`` directive.
+
+    Keeps the cross-version changes found in the imported files, along with
+    the files and notes directories they came from so that the entry can
+    be checked for staleness before being reused by another document.
+
+    """
+
+    def __init__(self, changes, dependencies, notes_dirs):
+        self.changes = [
+            (version, detached_change(change)) for version, change in changes
+        ]
+        self.dependencies = dependencies
+        self.notes_dirs = notes_dirs
+        self._stats = {}
+        for path in dependencies:
+            self._stats[path] = _stat_key(path)
+        for path, fnames in notes_dirs:
+            for fname in fnames:
+                fpath = os.path.join(path, fname)
+                self._stats[fpath] = _stat_key(fpath)
+
+    def is_current(self):
+        for path, stat_key in self._stats.items():
+            if _stat_key(path) != stat_key:
+                return False
+        for path, fnames in self.notes_dirs:
+            if list_note_files(path) != fnames:
+                return False
+        return True
+
+
+# ImportedChanges per import directive, for the life of the process
+_imported_changes = {}
+
+
+def get_imported_changes(key):
+    imported = _imported_changes.get(key)
+    if imported is not None and imported.is_current():
+        return imported
+    return None
+
+
+def put_imported_changes(key, imported):
+    _imported_changes[key] = imported
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def list_note_files(path):
+    """Return the sorted ``.rst`` filenames of a notes directory, or None
+    if it can't be listed.
+
+    This is the one place the fragments of a notes directory are listed,
+    so that those parsed are those hashed for staleness.
+
+    """
+    try:
+        return sorted(
+            fname for fname in os.listdir(path) if fname.endswith(".rst")
+        )
+    except OSError:
+        return None
+
+
+# nodes that are registered with their document when parsed
+_DOCUMENT_NODES = (
+    nodes.target,
+    nodes.pending,
+    nodes.footnote,
+    nodes.footnote_reference,
+    nodes.citation,
+    nodes.citation_reference,
+    nodes.substitution_definition,
+    nodes.substitution_reference,
+    nodes.system_message,
+)
+
+
+def needs_document(node):
+    """Return True if a parsed body has nodes that its document keeps
+    track of, such as hyperlink targets and the references naming them.
+
+    Such a body can't be moved into another document without those nodes
+    being registered there again, so it isn't cached.
+
+    """
+    for subnode in node.traverse(nodes.Element):
+        if isinstance(subnode, _DOCUMENT_NODES):
+            return True
+        if (
+            subnode["ids"]
+            or subnode["names"]
+            or subnode.get("refname")
+            or subnode.get("refid")
+            or subnode.get("anonymous")
+        ):
+            return True
+    return False
+
+
+def attach_change(change, document):
+    """Make a change retrieved from a cache part of ``document``."""
+
+    for subnode in change["node"].traverse():
+        subnode.document = document
+
+
+def detached_change(change):
+    # nodes refer back to the document they were parsed in, which we
+    # don't want to pickle along with them
+    node = change["node"].deepcopy()
+    for subnode in node.traverse():
+        subnode.document = None
+    detached = dict(change)
+    detached["node"] = node
+    return detached
@@ -1,56 +1,296 @@
 import argparse
+import collections
+import concurrent.futures
+import importlib
 import os
 import re
 import shutil
+import subprocess
 import sys
 import tempfile
 
-from . import mdwriter
 
+# stay well under the argv limits of any platform when passing
+# fragment filenames to git
+_MAX_ARGV_CHARS = 30000
 
-def release_notes_into_changelog_file(target_filename, version, release_date):
+
+_VERSION_LINE = re.compile(r".*:version: (\S+)\s*$")
+_NOTES_LINE = re.compile(r".*:include_notes_from: (.+)")
+
+
+class CommandError(Exception):
+    """Raised by a command for arguments it can't work with, such as a
+    pattern matching no files; reported as a usage error."""
+
+
+def release_notes_into_changelog_file(
+    target_filename, version, release_date, git=True, dry_run=False
+):
     """Read changelog fragment files and render them into a single .rst file.
 
-    remove the fragment files afterwards using git rm.
+    remove the fragment files afterwards using git rm, or from the
+    filesystem directly if ``git`` is False.
 
     The fragment files are located by looking for ':include_notes_from:'
     directives in the given changelog file.
 
+    If ``dry_run`` is True, the merged changelog is written to stdout and
+    the fragments that would be removed are listed on stderr; nothing on
+    disk is changed.
+
     """
-    output = tempfile.NamedTemporaryFile(
-        mode="w", delete=False, encoding="utf-8"
+    release_notes_into_changelog_files(
+        [(target_filename, version, release_date)], git=git, dry_run=dry_run
     )
-    with open(target_filename) as handle:
+
+
+def release_notes_from_manifest(manifest_filename, git=True, dry_run=False):
+    """Run :func:`.release_notes_into_changelog_files` from a manifest file.
+
+    Each non-blank line of the manifest that doesn't start with ``#`` reads
+    ``<changelog filename> <version> <release date>``, where the date is
+    the rest of the line.  Relative filenames are relative to the
+    manifest's directory.
+
+    """
+    entries = []
+    base = os.path.dirname(manifest_filename)
+    with open(manifest_filename, encoding="utf-8") as handle:
+        for num, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 2)
+            if len(fields) != 3:
+                raise ValueError(
+                    "%s line %d: expected '<filename> <version> <date>'"
+                    % (manifest_filename, num)
+                )
+            filename, version, release_date = fields
+            entries.append(
+                (os.path.join(base, filename), version, release_date)
+            )
+    release_notes_into_changelog_files(entries, git=git, dry_run=dry_run)
+
+
+def release_notes_into_changelog_files(entries, git=True, dry_run=False):
+    """Release several versions, in one or more changelog files, at once.
+
+    ``entries`` is a sequence of ``(filename, version, release_date)``
+    tuples.  Each changelog file is read once no matter how many of its
+    versions are being released, with the fragment files read
+    concurrently.  The new contents of every file are written to temporary
+    files next to their targets, and only once all of them have been
+    written successfully, and ``git rm`` has been checked to accept the
+    fragments, are they moved into place with ``os.replace()`` and the
+    fragments removed.  Fragments git doesn't track are removed from the
+    filesystem directly.
+
+    """
+    release_dates = collections.OrderedDict()
+    for filename, version, release_date in entries:
+        release_dates.setdefault(filename, {})[version] = release_date
+
+    written = []
+    consumed = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            for filename, dates in release_dates.items():
+                if dry_run:
+                    output = sys.stdout
+                else:
+                    output = tempfile.NamedTemporaryFile(
+                        mode="w",
+                        delete=False,
+                        encoding="utf-8",
+                        dir=os.path.dirname(os.path.abspath(filename)),
+                        prefix=".%s." % os.path.basename(filename),
+                        suffix=".tmp",
+                    )
+                    written.append((output.name, filename))
+                try:
+                    consumed.extend(
+                        _release_notes_into(filename, dates, output, executor)
+                    )
+                finally:
+                    if not dry_run:
+                        output.close()
+                if not dry_run:
+                    shutil.copymode(filename, output.name)
+
+        if git:
+            tracked = _git_tracked(consumed)
+            untracked = [path for path in consumed if path not in tracked]
+            tracked = [path for path in consumed if path in tracked]
+        else:
+            tracked = []
+            untracked = consumed
+
+        if not dry_run:
+            # fails for files git won't remove, such as ones with local
+            # modifications, before anything has been changed
+            _git_rm(tracked, dry_run=True)
+    except:  # noqa
+        for tmpname, filename in written:
+            os.unlink(tmpname)
+        raise
+
+    if dry_run:
+        for fname_path in consumed:
+            sys.stderr.write(
+                "would %sremove %s\n"
+                % ("git " if fname_path in tracked else "", fname_path)
+            )
+        return
+
+    for tmpname, filename in written:
+        os.replace(tmpname, filename)
+
+    _git_rm(tracked)
+    for fname_path in untracked:
+        os.remove(fname_path)
+
+
+def _release_notes_into(target_filename, release_dates, output, executor):
+    """Write the released form of one changelog file to ``output``.
+
+    Returns the list of fragment files that were merged in.
+
+    """
+    consumed = []
+    unreleased = set(release_dates)
+    with open(target_filename, encoding="utf-8") as handle:
         for line in handle:
-            m = re.match(r".*:version: %s" % version, line)
-            if m:
+            m = _VERSION_LINE.match(line)
+            if m and m.group(1) in release_dates:
+                unreleased.discard(m.group(1))
                 output.write(line)
-                output.write("    :released: %s\n" % release_date)
+                output.write("    :released: %s\n" % release_dates[m.group(1)])
                 continue
 
-            m = re.match(r".*:include_notes_from: (.+)", line)
+            m = _NOTES_LINE.match(line)
             if m:
                 notes_dir = os.path.join(
-                    os.path.dirname(target_filename), m.group(1)
+                    os.path.dirname(target_filename), m.group(1).strip()
                 )
-                for fname in os.listdir(notes_dir):
-                    if not fname.endswith(".rst"):
-                        continue
-                    fname_path = os.path.join(notes_dir, fname)
+                fname_paths = [
+                    os.path.join(notes_dir, fname)
+                    for fname in sorted(os.listdir(notes_dir))
+                    if fname.endswith(".rst")
+                ]
+                for text in executor.map(_read_fragment, fname_paths):
                     output.write("\n")
-                    with open(fname_path) as inner:
-                        for inner_line in inner:
-                            output.write(("    " + inner_line).rstrip() + "\n")
-                    os.system("git rm %s" % fname_path)
+                    output.write(text)
+                consumed.extend(fname_paths)
             else:
                 output.write(line)
-    output.close()
-    shutil.move(output.name, target_filename)
+
+    if unreleased:
+        raise ValueError(
+            "version(s) %s not found in %s"
+            % (", ".join(sorted(unreleased)), target_filename)
+        )
+    return consumed
+
+
+def _read_fragment(fname_path):
+    with open(fname_path, encoding="utf-8") as inner:
+        return "".join(
+            ("    " + inner_line).rstrip() + "\n" for inner_line in inner
+        )
+
+
+def _git_tracked(paths):
+    """Return the set of the given paths that git tracks."""
+
+    tracked = set()
+    for chunk in _argv_chunks(paths, _MAX_ARGV_CHARS):
+        try:
+            output = subprocess.check_output(
+                ["git", "ls-files", "-z", "--"] + chunk
+            )
+        except subprocess.CalledProcessError as err:
+            # git has already said why on stderr
+            raise CommandError(
+                "git ls-files exited with status %d; outside of a git "
+                "work tree, use --no-git" % err.returncode
+            )
+        except OSError as err:
+            raise CommandError(
+                "can't run git (%s); use --no-git to remove the fragment "
+                "files without it" % err
+            )
+        tracked.update(
+            os.path.abspath(os.fsdecode(path))
+            for path in output.split(b"\0")
+            if path
+        )
+    return set(path for path in paths if os.path.abspath(path) in tracked)
+
+
+def _git_rm(paths, dry_run=False):
+    """Run ``git rm`` on the given paths with as few processes as possible."""
+
+    cmd = ["git", "rm", "--quiet"]
+    if dry_run:
+        cmd.append("--dry-run")
+    for chunk in _argv_chunks(paths, _MAX_ARGV_CHARS):
+        subprocess.check_call(cmd + ["--"] + chunk)
+
+
+def _argv_chunks(args, max_chars):
+    chunk = []
+    size = 0
+    for arg in args:
+        if chunk and size + len(arg) + 1 > max_chars:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(arg)
+        size += len(arg) + 1
+    if chunk:
+        yield chunk
+
+
+def _lazy(module_name, fn_name):
+    """Return a callable that imports ``changelog.<module_name>`` and
+    calls a function in it.
+
+    Subcommands import the modules they need only once they run, so that
+    commands such as release-notes don't pay for importing docutils.
+
+    """
+
+    def call(*arg, **kw):
+        module = importlib.import_module("." + module_name, __package__)
+        return getattr(module, fn_name)(*arg, **kw)
+
+    return call
+
+
+def _header(text):
+    name, sep, value = text.partition(":")
+    if not sep or not name.strip():
+        raise argparse.ArgumentTypeError(
+            "expected 'Name: value', got %r" % text
+        )
+    return name.strip(), value.strip()
+
+
+def _add_profile_argument(subparser):
+    subparser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write phase timings as Chrome trace-event JSON to FILE and "
+        "print a summary on stderr; covers this process only, not -j "
+        "workers",
+    )
 
 
 def main(argv=None):
     parser = argparse.ArgumentParser()
-    subparsers = parser.add_subparsers()
+    subparsers = parser.add_subparsers(dest="command")
 
     subparser = subparsers.add_parser(
         "release-notes", help="Merge notes files into changelog and git rm"
@@ -60,18 +300,77 @@ def main(argv=None):
         "version", help="version string as it appears in changelog"
     )
     subparser.add_argument("date", help="full text of datestamp to insert")
+    subparser.add_argument(
+        "--no-git",
+        dest="git",
+        action="store_false",
+        help="delete the merged fragment files directly instead of "
+        "running git rm",
+    )
+    subparser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="write the merged changelog to stdout and list the fragment "
+        "files that would be removed, without changing anything",
+    )
     subparser.set_defaults(
         cmd=(
             release_notes_into_changelog_file,
-            ["filename", "version", "date"],
+            ["filename", "version", "date", "git", "dry_run"],
         )
     )
 
+    subparser = subparsers.add_parser(
+        "release-manifest",
+        help="Merge notes files into several changelogs and versions at "
+        "once, as listed in a manifest file",
+    )
+    subparser.add_argument(
+        "manifest",
+        help="file with one '<changelog filename> <version> <date>' "
+        "entry per line",
+    )
+    subparser.add_argument(
+        "--no-git",
+        dest="git",
+        action="store_false",
+        help="delete the merged fragment files directly instead of "
+        "running git rm",
+    )
+    subparser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="write the merged changelogs to stdout and list the fragment "
+        "files that would be removed, without changing anything",
+    )
+    subparser.set_defaults(
+        cmd=(release_notes_from_manifest, ["manifest", "git", "dry_run"])
+    )
+
     subparser = subparsers.add_parser(
         "generate-md", help="Generate file into markdown"
     )
-    subparser.add_argument("filename", help="target changelog filename")
+    subparser.add_argument(
+        "filenames",
+        nargs="+",
+        metavar="filename",
+        help="target changelog filename(s) or glob pattern(s)",
+    )
     subparser.add_argument("-c", "--config", help="path to conf.py")
+    _add_profile_argument(subparser)
+    subparser.add_argument(
+        "-o",
+        "--output-dir",
+        help="write a .md file per changelog file into this directory; "
+        "required when rendering more than one file",
+    )
+    subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of files to render in parallel",
+    )
     subparser.add_argument(
         "-v",
         "--version",
@@ -86,14 +385,290 @@ def main(argv=None):
     )
     subparser.set_defaults(
         cmd=(
-            mdwriter.render_changelog_as_md,
-            ["filename", "config", "version", "sections_only"],
+            _lazy("mdwriter", "render_changelogs_as_md"),
+            [
+                "filenames",
+                "config",
+                "output_dir",
+                "version",
+                "sections_only",
+                "jobs",
+            ],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "render",
+        help="Render each version section of a changelog file to files in "
+        "several formats, parsing the file once",
+    )
+    subparser.add_argument("filename", help="target changelog filename")
+    subparser.add_argument("-c", "--config", help="path to conf.py")
+    _add_profile_argument(subparser)
+    subparser.add_argument(
+        "-f",
+        "--format",
+        dest="formats",
+        default="md",
+        help="comma separated formats out of md, txt, json and html "
+        "(default: md)",
+    )
+    subparser.add_argument(
+        "-o",
+        "--out-dir",
+        required=True,
+        help="directory to write <version>.<format> files into",
+    )
+    subparser.add_argument(
+        "-v",
+        "--version",
+        dest="versions",
+        action="append",
+        help="render only this version; may be given more than once",
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("render", "render_to_directory"),
+            ["filename", "config", "formats", "out_dir", "versions"],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "watch",
+        help="Re-render the changed versions of a changelog file each time "
+        "it, its notes files, the files it imports or the config file are "
+        "edited",
+    )
+    subparser.add_argument("filename", help="target changelog filename")
+    subparser.add_argument("-c", "--config", help="path to conf.py")
+    _add_profile_argument(subparser)
+    subparser.add_argument(
+        "-v",
+        "--version",
+        dest="versions",
+        action="append",
+        help="watch only this version; may be given more than once",
+    )
+    subparser.add_argument(
+        "-o",
+        "--output",
+        help="keep the markdown of all watched versions in this file, "
+        "instead of printing the re-rendered ones to stdout",
+    )
+    subparser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.2,
+        help="seconds without further changes to wait before rendering "
+        "(default: %(default)s)",
+    )
+    subparser.add_argument(
+        "--poll",
+        action="store_true",
+        help="poll file stats instead of using inotify",
+    )
+    subparser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="seconds between polls (default: %(default)s)",
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("watch", "watch_changelog"),
+            [
+                "filename",
+                "config",
+                "versions",
+                "output",
+                "debounce",
+                "poll",
+                "interval",
+            ],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "export",
+        help="Write the change records of a changelog file as "
+        "newline-delimited JSON",
+    )
+    subparser.add_argument("filename", help="target changelog filename")
+    subparser.add_argument("-c", "--config", help="path to conf.py")
+    _add_profile_argument(subparser)
+    subparser.add_argument(
+        "-o", "--output", help="write to this file instead of stdout"
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("export", "export_change_records"),
+            ["filename", "config", "output"],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "index",
+        help="Add changelog files to a SQLite index of change records, "
+        "re-parsing only files that have changed",
+    )
+    subparser.add_argument(
+        "filenames",
+        nargs="+",
+        metavar="filename",
+        help="target changelog filename(s)",
+    )
+    subparser.add_argument("-c", "--config", help="path to conf.py")
+    _add_profile_argument(subparser)
+    subparser.add_argument(
+        "-d",
+        "--database",
+        default="changelog.db",
+        help="path to the index database (default: changelog.db)",
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("index", "build_index"),
+            ["database", "filenames", "config"],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "query", help="Query a SQLite index built with 'changelog index'"
+    )
+    subparser.add_argument(
+        "-d",
+        "--database",
+        default="changelog.db",
+        help="path to the index database (default: changelog.db)",
+    )
+    subparser.add_argument(
+        "--ticket",
+        dest="tickets",
+        action="append",
+        help="changes for this ticket; may be given more than once to "
+        "match any of them",
+    )
+    subparser.add_argument(
+        "--tag",
+        dest="tags",
+        action="append",
+        help="changes with this tag; may be given more than once to "
+        "match all of them",
+    )
+    subparser.add_argument(
+        "--version-range",
+        help="changes listed under versions LOW:HIGH, inclusive; either "
+        "end may be left out, e.g. '1.3:'",
+    )
+    subparser.add_argument(
+        "--file",
+        dest="files",
+        action="append",
+        help="changes from this changelog file only; may be given more "
+        "than once",
+    )
+    subparser.add_argument(
+        "--json",
+        dest="as_json",
+        action="store_true",
+        help="write one JSON object per change instead of a table",
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("index", "print_change_records"),
+            [
+                "database",
+                "tickets",
+                "tags",
+                "version_range",
+                "files",
+                "as_json",
+            ],
+        )
+    )
+
+    subparser = subparsers.add_parser(
+        "publish",
+        help="Send new or changed changelog sections, one per version, "
+        "to an HTTP endpoint",
+    )
+    subparser.add_argument("filename", help="target changelog filename")
+    subparser.add_argument("-c", "--config", help="path to conf.py")
+    subparser.add_argument(
+        "--url",
+        required=True,
+        help="URL to send each section to; may contain {version}",
+    )
+    subparser.add_argument(
+        "--method", default="POST", help="HTTP method (default: POST)"
+    )
+    subparser.add_argument(
+        "-H",
+        "--header",
+        dest="headers",
+        action="append",
+        type=_header,
+        help="extra 'Name: value' request header; may be given more "
+        "than once",
+    )
+    subparser.add_argument(
+        "--state",
+        help="JSON file of content hashes of the sections already sent; "
+        "only new or changed sections are sent",
+    )
+    subparser.add_argument(
+        "-v",
+        "--version",
+        dest="versions",
+        action="append",
+        help="publish only this version; may be given more than once",
+    )
+    subparser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="requests in flight at once (default: 4)",
+    )
+    subparser.add_argument(
+        "--retries",
+        type=int,
+        default=4,
+        help="retries for each section on connection errors, 429 and "
+        "5xx responses (default: 4)",
+    )
+    subparser.add_argument(
+        "--force",
+        action="store_true",
+        help="send every section, changed or not",
+    )
+    subparser.set_defaults(
+        cmd=(
+            _lazy("publish", "publish_to_url"),
+            [
+                "filename",
+                "config",
+                "url",
+                "method",
+                "headers",
+                "state",
+                "versions",
+                "concurrency",
+                "retries",
+                "force",
+            ],
         )
     )
 
     options = parser.parse_args(argv)
+    if getattr(options, "profile", None):
+        _lazy("profile", "enable")(options.profile)
     fn, argnames = options.cmd
-    fn(*[getattr(options, name) for name in argnames])
+    try:
+        return fn(*[getattr(options, name) for name in argnames])
+    except (CommandError, ValueError) as err:
+        # the library functions behind the commands raise ValueError for
+        # arguments they can't work with
+        subparsers.choices[options.command].error(str(err))
 
 
 if __name__ == "__main__":
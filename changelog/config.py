@@ -0,0 +1,146 @@
+"""Load the ``changelog_*`` settings for use outside of Sphinx.
+
+A Sphinx ``conf.py`` typically imports themes, extensions and version
+detection code that the changelog settings don't depend on.  Rather than
+running the whole file, the ``changelog_*`` assignments are picked out of
+it with :mod:`ast`; the file is only executed if one of those values is
+computed rather than written out as a literal.  Results are cached per
+content hash for the life of the process; a file that has to be executed
+is executed again by each process, as what it computes may depend on the
+environment, the working directory or the modules it imports.
+
+Settings may also come from a dedicated ``.cfg`` / ``.ini`` file with a
+``[changelog]`` section, where values are Python literals or plain
+strings and the ``changelog_`` prefix may be left off::
+
+    [changelog]
+    sections = ["general", "orm", "sql"]
+    inner_tag_sort = ["feature", "bug"]
+    render_ticket = https://example.com/ticket/%s
+
+"""
+import ast
+import configparser
+import hashlib
+import os
+
+PREFIX = "changelog_"
+
+_INI_SECTION = "changelog"
+
+# {content hash: settings}, for the life of the process
+_loaded = {}
+
+
+def load_config(config_filename):
+    """Return the ``changelog_*`` settings of a config file as a dictionary.
+
+    ``config_filename`` is either a Python file such as a Sphinx
+    ``conf.py``, or a ``.cfg`` / ``.ini`` file with a ``[changelog]``
+    section.  Returns an empty dictionary if ``config_filename`` is None.
+
+    """
+    if config_filename is None:
+        return {}
+
+    with open(config_filename, "rb") as handle:
+        source = handle.read()
+    ini = os.path.splitext(config_filename)[1] in (".cfg", ".ini")
+    digest = hashlib.sha1((b"ini:" if ini else b"py:") + source).hexdigest()
+
+    if digest not in _loaded:
+        if ini:
+            config = _load_ini(source.decode("utf-8"), config_filename)
+        else:
+            config = _load_python(source, config_filename)
+        _loaded[digest] = config
+    return dict(_loaded[digest])
+
+
+def _load_ini(text, config_filename):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read_string(text, source=config_filename)
+    config = {}
+    if not parser.has_section(_INI_SECTION):
+        return config
+    for key, value in parser.items(_INI_SECTION):
+        if not key.startswith(PREFIX):
+            key = PREFIX + key
+        try:
+            config[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            config[key] = value
+    return config
+
+
+def _load_python(source, config_filename):
+    config = _extract_literals(source, config_filename)
+    if config is not None:
+        return config
+
+    namespace = {"__file__": os.path.abspath(config_filename)}
+    exec(compile(source, config_filename, "exec"), namespace)
+    config = {
+        key: value
+        for key, value in namespace.items()
+        if key.startswith(PREFIX)
+    }
+    return config
+
+
+def _extract_literals(source, config_filename):
+    """Return the ``changelog_*`` settings if they're all plain literals
+    assigned once at module level, else None."""
+
+    tree = ast.parse(source, config_filename)
+    config = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id.startswith(PREFIX):
+            # any other use of the name, such as a loop target, an
+            # augmented assignment or a method call that may mutate the
+            # value, needs the file to be run
+            if not _is_simple_assign(tree, node):
+                return None
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if any(
+                (alias.asname or alias.name).startswith(PREFIX)
+                or alias.name == "*"
+                for alias in node.names
+            ):
+                return None
+
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign):
+            targets, value = stmt.targets, stmt.value
+        elif isinstance(stmt, ast.AnnAssign) and stmt.value is not None:
+            targets, value = [stmt.target], stmt.value
+        else:
+            continue
+        names = [
+            target.id
+            for target in targets
+            if isinstance(target, ast.Name) and target.id.startswith(PREFIX)
+        ]
+        if not names:
+            continue
+        try:
+            literal = ast.literal_eval(value)
+        except (ValueError, TypeError, SyntaxError):
+            return None
+        for name in names:
+            if name in config:
+                return None
+            config[name] = literal
+    return config
+
+
+def _is_simple_assign(tree, name_node):
+    # the name is the whole target of a top level assignment, rather than
+    # being assigned in a loop, a conditional, a function, by unpacking...
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and name_node in stmt.targets:
+            return True
+        if isinstance(stmt, ast.AnnAssign) and stmt.target is name_node:
+            return True
+    return False
@@ -1,6 +1,10 @@
+import bisect
 import collections
-from distutils.version import LooseVersion
+import concurrent.futures
+import copy
+import functools
 import hashlib as md5
+import itertools
 import os
 import re
 import sys
@@ -10,11 +14,12 @@ from docutils import nodes
 from docutils.parsers.rst import Directive
 from docutils.parsers.rst import directives
 from docutils.parsers.rst import roles
+from docutils.statemachine import StringList
 
+from . import cache
 from . import generate_rst
 from .environment import Environment
-
-py3k = sys.version_info >= (3, 0)
+from .versionsort import version_key
 
 
 def _comma_list(text):
@@ -40,6 +45,89 @@ def _parse_content(content):
     return d
 
 
+def _split_explicit_markup(content):
+    """Split directive content into one block per top-level ``..`` item."""
+
+    starts = [idx for idx, line in enumerate(content) if line.startswith("..")]
+    for start, end in zip(starts, starts[1:] + [len(content)]):
+        yield content[start:end]
+
+
+_TRAILING_WHITESPACE = re.compile(r"[^\S\n]+$", re.M)
+
+
+def _read_note_file(fpath, profiler):
+    """Return ``(has_tabs, lines)`` for a note file.
+
+    Tabs become four spaces and trailing whitespace is removed, working
+    on the whole text of the file at once.
+
+    """
+    with profiler.fragment(fpath):
+        with open(fpath, encoding="utf-8") as handle:
+            text = handle.read()
+        has_tabs = "\t" in text
+        if has_tabs:
+            text = text.replace("\t", "    ")
+        lines = _TRAILING_WHITESPACE.sub("", text).split("\n")
+        if not lines[-1]:
+            lines.pop()
+        return has_tabs, lines
+
+
+def _iter_note_files(profiler, fpaths):
+    """Read note files concurrently, yielding ``(has_tabs, lines)`` for
+    each of ``fpaths`` in order."""
+
+    if not fpaths:
+        return
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(len(fpaths), 16)
+    ) as executor:
+        for result in executor.map(
+            _read_note_file, fpaths, itertools.repeat(profiler)
+        ):
+            yield result
+
+
+def _read_note_files(env, path, fnames, version):
+    """Read the note files of a directory.
+
+    Files are read concurrently.  Returns a list of ``(fpath, lines)``,
+    where ``lines`` is a StringList keeping the file and line number each
+    line came from.
+
+    """
+    fpaths = [os.path.join(path, fname) for fname in fnames]
+    results = _iter_note_files(env.profiler, fpaths)
+    fragments = []
+    tabbed = []
+    for fname in env.status_iterator(
+        fnames, "reading changelog note files (version %s)..." % version
+    ):
+        fpath = os.path.join(path, fname)
+        has_tabs, lines = next(results)
+        if has_tabs:
+            tabbed.append(fname)
+        fragments.append((fpath, _fragment_lines(fpath, lines)))
+    _warn_tabbed(path, tabbed)
+    return fragments
+
+
+def _fragment_lines(fpath, lines):
+    return StringList(
+        lines, items=list(zip(itertools.repeat(fpath), range(len(lines))))
+    )
+
+
+def _warn_tabbed(path, fnames):
+    if fnames:
+        warnings.warn(
+            "%d file(s) in %s have tabs in them! please convert to "
+            "spaces: %s" % (len(fnames), path, ", ".join(fnames))
+        )
+
+
 class EnvDirective(object):
     @property
     def env(self):
@@ -52,6 +140,12 @@ class EnvDirective(object):
             env.temp_data[key] = collections.OrderedDict()
         return env.temp_data[key]
 
+    @classmethod
+    def discard_changes_list(cls, env, hash_on_version):
+        env.temp_data.pop(
+            ("ChangeLogDirective_changes", hash_on_version), None
+        )
+
 
 class ChangeLogDirective(EnvDirective, Directive):
     """Implement the ``.. changelog::`` directive.
@@ -66,7 +160,17 @@ class ChangeLogDirective(EnvDirective, Directive):
         self._parse()
 
         if not ChangeLogImportDirective.in_include_directive(self.env):
-            return generate_rst.render_changelog(self)
+            self.env.note_change_records(
+                self.version,
+                self.get_changes_list(self.env, self.version).values(),
+            )
+            if not self.env.render_version(self.version):
+                # nothing else looks at this version's records once
+                # they've been handed off
+                self.discard_changes_list(self.env, self.version)
+                return []
+            with self.env.profiler.span("render changelog", self.version):
+                return generate_rst.render_changelog(self)
         else:
             return []
 
@@ -89,6 +193,8 @@ class ChangeLogDirective(EnvDirective, Directive):
         content = self.content
 
         # 3. read extra per-file included notes
+        notes_cache = None
+        note_fragments = ()
         if "include_notes_from" in parsed:
             if content.items and content.items[0]:
                 source = content.items[0][0]
@@ -103,35 +209,129 @@ class ChangeLogDirective(EnvDirective, Directive):
                 )
             else:
                 path = parsed["include_notes_from"]
-            if not os.path.exists(path):
+            with self.env.profiler.span("list fragments", path):
+                files = cache.list_note_files(path)
+            if files is None:
                 raise Exception("included nodes path %s does not exist" % path)
+            self.env.note_notes_files(path, files)
+            notes_dirs = self.env.temp_data.get(
+                "ChangeLogImportDirective_notes"
+            )
+            if notes_dirs is not None:
+                notes_dirs.append((path, files))
 
-            files = [
-                fname for fname in os.listdir(path) if fname.endswith(".rst")
-            ]
-            for fname in self.env.status_iterator(
-                files, "reading changelog note files (version %s)..." % version
+            cache_dir = self.env.changelog_notes_cache_dir
+            if (
+                cache_dir
+                and not ChangeLogImportDirective.in_include_directive(self.env)
             ):
-                fpath = os.path.join(path, fname)
-                with open(fpath) as handle:
-                    content.append("", path, 0)
-                    for num, line in enumerate(handle):
-                        if not py3k:
-                            line = line.decode("utf-8")
-                        if "\t" in line:
-                            warnings.warn(
-                                "file %s has a tab in it! please "
-                                "convert to spaces." % fname
-                            )
-                            line = line.replace("\t", "    ")
-                        line = line.rstrip()
-                        content.append(line, path, num)
+                # note files are parsed one at a time below, after the
+                # content of the directive itself
+                notes_cache = cache.NotesCache(
+                    cache_dir, path, cache.config_key(self.env)
+                )
+            else:
+                # parsed one at a time below, after the content of the
+                # directive itself
+                note_fragments = _read_note_files(
+                    self.env, path, files, version
+                )
 
         # 4. parse the content of the .. changelog:: directive. This
         # is where we parse individual .. change:: directives and construct
         # a list of items, stored in the env via self.get_changes_list(env)
         p = nodes.paragraph("", "")
-        self.state.nested_parse(content[1:], 0, p)
+        with self.env.profiler.span("parse changelog", version):
+            self.state.nested_parse(content[1:], 0, p)
+        for fpath, fragment in note_fragments:
+            with self.env.profiler.fragment(fpath):
+                self.state.nested_parse(fragment, 0, p)
+
+        # 5. add changes from note files, re-parsing only those that
+        # aren't in the cache
+        if notes_cache is not None:
+            # files that are new or changed, or whose changes aren't in
+            # the cache, are read up front, concurrently
+            stats = {}
+            entries = {}
+            for fname in files:
+                stats[fname] = os.stat(os.path.join(path, fname))
+                entries[fname] = notes_cache.digest_for(fname, stats[fname])
+            unread = [
+                fname
+                for fname in files
+                if entries[fname] is None
+                or not notes_cache.has(entries[fname][0])
+            ]
+            contents = dict(
+                zip(
+                    unread,
+                    _iter_note_files(
+                        self.env.profiler,
+                        [os.path.join(path, fname) for fname in unread],
+                    ),
+                )
+            )
+
+            tabbed = []
+            for fname in self.env.status_iterator(
+                files, "reading changelog note files (version %s)..." % version
+            ):
+                fpath = os.path.join(path, fname)
+                with self.env.profiler.fragment(fpath):
+                    has_tabs = self._parse_cached_note(
+                        notes_cache,
+                        fname,
+                        fpath,
+                        stats[fname],
+                        entries[fname],
+                        contents.get(fname),
+                    )
+                if has_tabs:
+                    tabbed.append(fname)
+            notes_cache.save()
+            _warn_tabbed(path, tabbed)
+
+    def _parse_cached_note(
+        self, notes_cache, fname, fpath, stat, entry, contents
+    ):
+        """Add the changes from a single note file, consulting the cache.
+
+        ``entry`` is what the cache has for the file, if its stat info is
+        unchanged, and ``contents`` is ``(has_tabs, lines)`` if the file
+        was read.  On a cache miss the file is parsed on its own and the
+        changes it produces are stored in the cache for the next build.
+        Returns True if the file has tabs in it.
+
+        """
+        if entry is None:
+            has_tabs, lines = contents
+            digest = cache.content_hash("\n".join(lines))
+            notes_cache.note_file(fname, stat, digest, has_tabs)
+        else:
+            digest, has_tabs = entry
+
+        changes = notes_cache.get(digest)
+        if changes is not None:
+            self.env.profiler.count("notes cache hits")
+            for change in changes:
+                cache.attach_change(change, self.state.document)
+                _add_change(self.env, self.version, change)
+            return has_tabs
+
+        self.env.profiler.count("notes cache misses")
+        has_tabs, lines = contents
+
+        fragment = _fragment_lines(fpath, lines)
+
+        changes = self.env.temp_data["ChangeLogDirective_collect"] = []
+        try:
+            p = nodes.paragraph("", "")
+            self.state.nested_parse(fragment, 0, p)
+        finally:
+            del self.env.temp_data["ChangeLogDirective_collect"]
+        notes_cache.put(digest, changes)
+        return has_tabs
 
 
 class ChangeLogImportDirective(EnvDirective, Directive):
@@ -150,14 +350,78 @@ class ChangeLogImportDirective(EnvDirective, Directive):
         return "ChangeLogDirective_includes" in env.temp_data
 
     def run(self):
+        if self.in_include_directive(self.env):
+            return []
+
+        # the same files are typically imported by the changelog for every
+        # later series; parse each imported file once and replay the
+        # changes found in it for each document that imports it
+        source_dir = os.path.dirname(self.state.document.current_source or "")
+        config_key = cache.config_key(self.env)
+        for block in _split_explicit_markup(self.content):
+            key = (source_dir, tuple(block), config_key)
+            imported = cache.get_imported_changes(key)
+            if imported is None:
+                with self.env.profiler.span("parse imports"):
+                    imported = self._parse_imports(block)
+                # changes referring to other nodes of this document can't
+                # be replayed into another one
+                if not any(
+                    cache.needs_document(change["node"])
+                    for version, change in imported.changes
+                ):
+                    cache.put_imported_changes(key, imported)
+            else:
+                self.env.profiler.count("import cache hits")
+                with self.env.profiler.span("replay imports"):
+                    self._replay_imports(imported)
+        return []
+
+    def _parse_imports(self, content):
+        settings = self.state.document.settings
+        dependencies = getattr(settings, "record_dependencies", None)
+        before = set(dependencies.list) if dependencies else set()
+
         # tell ChangeLogDirective we're here, also prevent
         # nested .. include calls
-        if not self.in_include_directive(self.env):
-            self.env.temp_data["ChangeLogDirective_includes"] = True
+        temp_data = self.env.temp_data
+        temp_data["ChangeLogDirective_includes"] = True
+        changes = temp_data["ChangeLogImportDirective_collect"] = []
+        notes_dirs = temp_data["ChangeLogImportDirective_notes"] = []
+        try:
             p = nodes.paragraph("", "")
-            self.state.nested_parse(self.content, 0, p)
-            del self.env.temp_data["ChangeLogDirective_includes"]
-        return []
+            self.state.nested_parse(content, 0, p)
+        finally:
+            del temp_data["ChangeLogDirective_includes"]
+            del temp_data["ChangeLogImportDirective_collect"]
+            del temp_data["ChangeLogImportDirective_notes"]
+
+        return cache.ImportedChanges(
+            changes,
+            [
+                path
+                for path in (dependencies.list if dependencies else ())
+                if path not in before
+            ],
+            notes_dirs,
+        )
+
+    def _replay_imports(self, imported):
+        dependencies = getattr(
+            self.state.document.settings, "record_dependencies", None
+        )
+        if dependencies is not None:
+            for path in imported.dependencies:
+                dependencies.add(path)
+        for path, fnames in imported.notes_dirs:
+            self.env.note_notes_files(path, fnames)
+        self.env.profiler.count("deepcopies", len(imported.changes))
+        for version, change in imported.changes:
+            # each document gets its own copy of the body, as the read
+            # transforms for a document may modify it
+            change = dict(change, node=change["node"].deepcopy())
+            cache.attach_change(change, self.state.document)
+            _add_change(self.env, version, change)
 
 
 class SeeAlsoDirective(EnvDirective, Directive):
@@ -191,119 +455,282 @@ class ChangeDirective(EnvDirective, Directive):
 
         content = _parse_content(self.content)
 
-        sorted_tags = _comma_list(content.get("tags", ""))
         changelog_directive = self.env.temp_data["ChangeLogDirective"]
-        declared_version = changelog_directive.version
-        versions = (
-            set(_comma_list(content.get("versions", "")))
-            .difference([""])
-            .union([declared_version])
-        )
 
         # if we don't refer to any other versions and we're in an include,
         # skip
         if len(
-            versions
+            _change_versions(content, changelog_directive.version)
         ) == 1 and ChangeLogImportDirective.in_include_directive(self.env):
 
             return []
 
         body_paragraph = nodes.paragraph("", "", classes=["caption"])
-        self.state.nested_parse(content["text"], 0, body_paragraph)
+        with self.env.profiler.span("parse change body"):
+            self.state.nested_parse(content["text"], 0, body_paragraph)
+
+        change = {
+            "content": {
+                key: value for key, value in content.items() if key != "text"
+            },
+            "node": body_paragraph,
+            "raw_text": _text_rawsource_from_node(body_paragraph),
+        }
+
+        # ChangeLogDirective is collecting changes for its notes cache
+        collect = self.env.temp_data.get("ChangeLogDirective_collect")
+        if collect is not None:
+            collect.append(change)
+
+        # ChangeLogImportDirective is collecting changes to reuse for
+        # other documents importing the same files
+        collect = self.env.temp_data.get("ChangeLogImportDirective_collect")
+        if collect is not None:
+            collect.append((changelog_directive.version, change))
+
+        _add_change(self.env, changelog_directive.version, change)
+        return []
 
-        raw_text = _text_rawsource_from_node(body_paragraph)
-        tickets = set(_comma_list(content.get("tickets", ""))).difference([""])
-        pullreq = set(_comma_list(content.get("pullreq", ""))).difference([""])
-        tags = set(sorted_tags).difference([""])
 
-        for hash_on_version in versions:
+def _change_versions(content, declared_version):
+    return (
+        set(_comma_list(content.get("versions", "")))
+        .difference([""])
+        .union([declared_version])
+    )
+
+
+def _add_change(env, declared_version, change):
+    """Add a parsed ``.. change::`` to the records of each of its versions.
+
+    ``change`` is a dictionary of the directive's options, its parsed body
+    node and the raw text of that body, as produced by
+    :meth:`.ChangeDirective.run` or retrieved from a cache.
+    ``declared_version`` is the version of the ``.. changelog::`` it
+    appeared in.
+
+    """
+    content = change["content"]
+    body_paragraph = change["node"]
+    raw_text = change["raw_text"]
+
+    sorted_tags = _comma_list(content.get("tags", ""))
+    versions = _change_versions(content, declared_version)
+
+    tickets = set(
+        sys.intern(ticket)
+        for ticket in _comma_list(content.get("tickets", ""))
+    ).difference([""])
+    pullreq = set(_comma_list(content.get("pullreq", ""))).difference([""])
+    changeset = set(_comma_list(content.get("changeset", ""))).difference([""])
+    tags = set(sorted_tags).difference([""])
+
+    profiler = env.profiler
+    profiler.count("changes")
+    for hash_on_version in versions:
+        with profiler.span("hash"):
             issue_hash = _get_robust_version_hash(
                 raw_text, hash_on_version, tickets, tags
             )
 
-            rec = ChangeLogDirective.get_changes_list(
-                changelog_directive.env, hash_on_version
-            ).setdefault(issue_hash, {})
-            if not rec:
-                sorted(versions, key=_str_version_as_tuple)
-                rec.update(
-                    {
-                        "hash": issue_hash,
-                        "render_for_version": hash_on_version,
-                        "tags": tags,
-                        "tickets": tickets,
-                        "pullreq": pullreq,
-                        "changeset": set(
-                            _comma_list(content.get("changeset", ""))
-                        ).difference([""]),
-                        "node": body_paragraph,
-                        "raw_text": raw_text,
-                        "type": "change",
-                        "title": content.get("title", None),
-                        "sorted_tags": sorted_tags,
-                        "versions": versions,
-                        "version_to_hash": {
-                            version: _get_legacy_version_hash(
-                                raw_text, version
-                            )
-                            for version in versions
-                        },
-                        "source_versions": [declared_version],
-                        "sorted_versions": list(
-                            reversed(
-                                sorted(versions, key=_str_version_as_tuple)
-                            )
-                        ),
-                    }
-                )
-            else:
-                # This seems to occur repeated times for each included
-                # changelog, not clear if sphinx has changed the scope
-                # of self.env to lead to this occurring more often
-                self.env.log_debug(
-                    "Merging changelog record '%s' from version(s) %s "
-                    "with that of version %s",
-                    _quick_rec_str(rec),
-                    ", ".join(rec["source_versions"]),
-                    declared_version,
-                )
-                rec["source_versions"].append(declared_version)
+        changes = ChangeLogDirective.get_changes_list(env, hash_on_version)
+        rec = changes.get(issue_hash)
+        if rec is None:
+            changes[issue_hash] = ChangeRecord(
+                issue_hash,
+                hash_on_version,
+                sorted_tags,
+                tickets,
+                pullreq,
+                changeset,
+                body_paragraph,
+                raw_text,
+                content.get("title", None),
+                versions,
+                declared_version,
+            )
+        else:
+            # This seems to occur repeated times for each included
+            # changelog, not clear if sphinx has changed the scope
+            # of self.env to lead to this occurring more often
+            env.log_debug(
+                "Merging changelog record '%s' from version(s) %s "
+                "with that of version %s",
+                _quick_rec_str(rec),
+                ", ".join(rec.source_versions),
+                declared_version,
+            )
+            profiler.count("merges")
+            rec.merge(
+                declared_version,
+                raw_text,
+                tags,
+                tickets,
+                pullreq,
+                changeset,
+                versions,
+            )
 
-                assert rec["raw_text"] == raw_text
-                assert rec["tags"] == tags
-                assert rec["render_for_version"] == hash_on_version
 
-                rec["tickets"].update(tickets)
-                rec["pullreq"].update(pullreq)
-                rec["changeset"].update(
-                    set(_comma_list(content.get("changeset", ""))).difference(
-                        [""]
-                    )
-                )
-                rec["versions"].update(versions)
+class ChangeRecord(object):
+    """A single change as rendered for one version.
 
-                rec["version_to_hash"].update(
-                    {
-                        version: _get_legacy_version_hash(raw_text, version)
-                        for version in versions
-                    }
-                )
-                rec["sorted_versions"] = list(
-                    reversed(
-                        sorted(rec["versions"], key=_str_version_as_tuple)
+    A ``.. change::`` that applies to several versions via ``:versions:``
+    produces one record per version; those records share their ticket,
+    pull request, changeset and version sets.  Tag sets are immutable and
+    shared between all records with the same tags.  The legacy per-version
+    hashes and the sorted version list are computed on first use, and the
+    sorted list is then kept up to date as versions are merged in.
+
+    """
+
+    __slots__ = (
+        "hash",
+        "render_for_version",
+        "tags",
+        "sorted_tags",
+        "tickets",
+        "pullreq",
+        "changeset",
+        "node",
+        "raw_text",
+        "title",
+        "versions",
+        "source_versions",
+        "id",
+        "_version_to_hash",
+        "_sorted_versions",
+        "_version_keys",
+    )
+
+    type = "change"
+
+    def __init__(
+        self,
+        hash_,
+        render_for_version,
+        sorted_tags,
+        tickets,
+        pullreq,
+        changeset,
+        node,
+        raw_text,
+        title,
+        versions,
+        source_version,
+    ):
+        self.hash = hash_
+        self.render_for_version = render_for_version
+        self.sorted_tags, self.tags = _intern_tags(sorted_tags)
+        self.tickets = tickets
+        self.pullreq = pullreq
+        self.changeset = changeset
+        self.node = node
+        self.raw_text = raw_text
+        self.title = title
+        self.versions = versions
+        self.source_versions = [source_version]
+        self.id = None
+        self._version_to_hash = None
+        self._sorted_versions = None
+        self._version_keys = None
+
+    @property
+    def version_to_hash(self):
+        if self._version_to_hash is None:
+            self._version_to_hash = {}
+        if len(self._version_to_hash) != len(self.versions):
+            for version in self.versions:
+                if version not in self._version_to_hash:
+                    self._version_to_hash[version] = _get_legacy_version_hash(
+                        self.raw_text, version
                     )
-                )
+        return self._version_to_hash
 
-        return []
+    @property
+    def sorted_versions(self):
+        """The versions of this change, newest first."""
+
+        if self._sorted_versions is None:
+            ascending = sorted(self.versions, key=version_key)
+            self._version_keys = [
+                version_key(version) for version in ascending
+            ]
+            self._sorted_versions = list(reversed(ascending))
+        return self._sorted_versions
+
+    def merge(
+        self,
+        source_version,
+        raw_text,
+        tags,
+        tickets,
+        pullreq,
+        changeset,
+        versions,
+    ):
+        """Merge in the same change as parsed from another changelog."""
+
+        self.source_versions.append(source_version)
+
+        assert self.raw_text == raw_text
+        assert self.tags == tags
+
+        self.tickets.update(tickets)
+        self.pullreq.update(pullreq)
+        self.changeset.update(changeset)
+        self.versions.update(versions)
+
+        if self._sorted_versions is not None:
+            for version in versions:
+                if version not in self._sorted_versions:
+                    self._insert_sorted_version(version)
+
+    def backported_versions(self, version):
+        """Return the versions older than the given one, newest first."""
+
+        sorted_versions = self.sorted_versions
+        idx = bisect.bisect_left(self._version_keys, version_key(version))
+        return sorted_versions[len(sorted_versions) - idx :]
+
+    def _insert_sorted_version(self, version):
+        # _version_keys is ascending, _sorted_versions descending
+        key = version_key(version)
+        idx = bisect.bisect_right(self._version_keys, key)
+        self._version_keys.insert(idx, key)
+        self._sorted_versions.insert(
+            len(self._version_keys) - 1 - idx, version
+        )
+
+    def detached(self):
+        """Return a copy of this record without its body node."""
+
+        rec = copy.copy(self)
+        rec.node = None
+        return rec
+
+
+def _intern_tags(sorted_tags):
+    """Return a shared ``(sorted_tags, tags)`` pair for a list of tags."""
+
+    return _tag_sets(tuple(sorted_tags))
+
+
+# bounded, as a long-running process such as a watch or repeated Sphinx
+# builds may see any number of tag combinations over time
+@functools.lru_cache(maxsize=1024)
+def _tag_sets(sorted_tags):
+    sorted_tags = tuple(sys.intern(tag) for tag in sorted_tags)
+    return sorted_tags, frozenset(sorted_tags).difference([""])
 
 
 def _quick_rec_str(rec):
     """try to print an identifiable description of a record"""
 
-    if rec["tickets"]:
-        return "[tickets: %s]" % ", ".join(rec["tickets"])
+    if rec.tickets:
+        return "[tickets: %s]" % ", ".join(rec.tickets)
     else:
-        return "%s..." % rec["raw_text"][0:25]
+        return "%s..." % rec.raw_text[0:25]
 
 
 def _get_legacy_version_hash(raw_text, version):
@@ -336,18 +763,6 @@ def _text_rawsource_from_node(node):
     return "".join(src)
 
 
-_VERSION_IDS = {}
-
-
-def _str_version_as_tuple(ver):
-    if ver in _VERSION_IDS:
-        return _VERSION_IDS[ver]
-
-    result = LooseVersion(ver)
-    _VERSION_IDS[ver] = result
-    return result
-
-
 def make_ticket_link(
     name, rawtext, text, lineno, inliner, options={}, content=[]
 ):
@@ -1,6 +1,9 @@
 import logging
 import sys
 
+from . import profile
+from .config import load_config
+
 LOG = logging.getLogger(__name__)
 
 
@@ -54,6 +57,31 @@ class Environment(object):
     def changelog_render_changeset(self):
         raise NotImplementedError()
 
+    @property
+    def changelog_notes_cache_dir(self):
+        raise NotImplementedError()
+
+    @property
+    def profiler(self):
+        """The :class:`.profile.Profiler` recording phase timings, or
+        :data:`.profile.NULL_PROFILER` if profiling is off."""
+        raise NotImplementedError()
+
+    def note_notes_files(self, path, fnames):
+        """Record the note files read from an ``:include_notes_from:``
+        directory for the document currently being parsed."""
+        raise NotImplementedError()
+
+    def note_change_records(self, version, records):
+        """Record the change records rendered for a version by the
+        document currently being parsed."""
+        raise NotImplementedError()
+
+    def render_version(self, version):
+        """Return False if the rendered nodes for the given version
+        won't be used, so that building them can be skipped."""
+        raise NotImplementedError()
+
     def status_iterator(self, elements, message):
         raise NotImplementedError()
 
@@ -63,11 +91,17 @@ class DefaultEnvironment(Environment):
     def from_document_settings(cls, settings):
         return settings.changelog_env
 
-    def __init__(self, config_filename=None):
+    def __init__(self, config_filename=None, config=None):
         self._temp_data = {}
-        self.config = {}
-        if config_filename is not None:
-            exec(open(config_filename).read(), self.config)
+        # versions whose nodes are rendered, or None for all of them
+        self.render_versions = None
+        if config is not None:
+            self.config = config
+        else:
+            self.config = load_config(config_filename)
+        profile_output = self.config.get("changelog_profile_output")
+        if profile_output:
+            profile.enable(profile_output)
 
     def log_debug(self, msg, *args):
         LOG.debug(msg, *args)
@@ -100,6 +134,27 @@ class DefaultEnvironment(Environment):
     def changelog_render_changeset(self):
         return self.config.get("changelog_render_changeset", "changeset:%s")
 
+    @property
+    def changelog_notes_cache_dir(self):
+        return self.config.get("changelog_notes_cache_dir", None)
+
+    @property
+    def changelog_output_cache_dir(self):
+        return self.config.get("changelog_output_cache_dir", None)
+
+    @property
+    def profiler(self):
+        return profile.process_profiler()
+
+    def note_notes_files(self, path, fnames):
+        pass
+
+    def note_change_records(self, version, records):
+        pass
+
+    def render_version(self, version):
+        return self.render_versions is None or version in self.render_versions
+
     def status_iterator(self, elements, message):
         for i, element in enumerate(elements, 1):
             percent = (i / len(elements)) * 100
@@ -0,0 +1,147 @@
+"""Export change records as newline-delimited JSON.
+
+Change records are handed off as each ``.. changelog::`` directive is
+parsed, and no rendered nodes are built for them, so a changelog of any
+size can be exported while holding only the records of the versions not
+yet reached.  Only docutils is required, not Sphinx.
+
+"""
+import hashlib
+import json
+import sys
+
+from docutils.core import publish_doctree
+
+from .docutils import setup_docutils
+from .environment import DefaultEnvironment
+from .environment import Environment
+
+
+class _ExportEnvironment(DefaultEnvironment):
+    def __init__(self, receive_record, config_filename=None, config=None):
+        super(_ExportEnvironment, self).__init__(
+            config_filename=config_filename, config=config
+        )
+        self.receive_record = receive_record
+        self.notes_dirs = []
+
+    def note_notes_files(self, path, fnames):
+        self.notes_dirs.append(path)
+
+    def note_change_records(self, version, records):
+        for rec in records:
+            self.receive_record(version, rec)
+
+    def render_version(self, version):
+        return False
+
+
+def record_hash(version, rec):
+    """Return an identifier for a change record within a version.
+
+    Unlike ``rec.hash``, which is only used to merge records within a
+    process and depends on set ordering, this is the same from one run
+    to the next for the same source.
+
+    """
+    return hashlib.sha1(
+        "\0".join(
+            [
+                version,
+                ",".join(sorted(rec.tickets)),
+                ",".join(rec.sorted_tags),
+                rec.raw_text,
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def record_as_dict(version, rec):
+    """Return a JSON-serializable dictionary for a change record.
+
+    ``version`` is the version whose section the record appears in.
+
+    """
+    return {
+        "version": version,
+        "hash": record_hash(version, rec),
+        "title": rec.title,
+        "tags": list(rec.sorted_tags),
+        "tickets": sorted(rec.tickets),
+        "pullreq": sorted(rec.pullreq),
+        "changeset": sorted(rec.changeset),
+        "versions": list(rec.sorted_versions),
+        "raw_text": rec.raw_text,
+    }
+
+
+def stream_change_records(target_filename, config_filename, receive_record):
+    """Send each change record of a changelog file to a callable.
+
+    The callable accepts two arguments, the version string of the
+    changelog section the record appears in, and the dictionary returned
+    by :func:`.record_as_dict` for it.  It is called for each record as
+    soon as the version it appears in has been parsed.
+
+    """
+    _publish_records(
+        target_filename,
+        _ExportEnvironment(
+            lambda version, rec: receive_record(
+                version, record_as_dict(version, rec)
+            ),
+            config_filename,
+        ),
+    )
+
+
+def _publish_records(target_filename, changelog_env):
+    """Parse a changelog file, sending its records to ``changelog_env``.
+
+    Returns the files read in by ``.. include::`` directives, including
+    those replayed from an earlier parse of a ``.. changelog_imports::``.
+
+    """
+    Environment.register(DefaultEnvironment)
+
+    setup_docutils()
+    with open(target_filename, encoding="utf-8") as handle, (
+        changelog_env.profiler.span("publish", target_filename)
+    ):
+        document = publish_doctree(
+            handle.read(),
+            source_path=target_filename,
+            settings_overrides={
+                "changelog_env": changelog_env,
+                "report_level": 3,
+            },
+        )
+    return document.settings.record_dependencies.list
+
+
+def export_change_records(
+    target_filename, config_filename, output=None, destination=None
+):
+    """Write the change records of a changelog file as NDJSON.
+
+    One JSON object, as returned by :func:`.record_as_dict`, is written
+    per line to ``destination``, or to the file named ``output``, or to
+    stdout.
+
+    """
+    if destination is None:
+        if output is not None:
+            with open(output, "w", encoding="utf-8") as destination:
+                return export_change_records(
+                    target_filename, config_filename, destination=destination
+                )
+        destination = sys.stdout
+
+    encoder = json.JSONEncoder(ensure_ascii=False, sort_keys=True)
+
+    def receive_record(version, record):
+        destination.write(encoder.encode(record))
+        destination.write("\n")
+
+    stream_change_records(target_filename, config_filename, receive_record)
+    destination.flush()
@@ -15,9 +15,10 @@ def render_changelog(changelog_directive):
     topsection = _run_top(changelog_directive, id_prefix)
     output.append(topsection)
 
-    bysection, all_sections = _organize_by_section(
-        changelog_directive, changes
-    )
+    with changelog_directive.env.profiler.span("organize sections"):
+        bysection, all_sections = _organize_by_section(
+            changelog_directive, changes
+        )
 
     counter = itertools.count()
 
@@ -29,7 +30,7 @@ def render_changelog(changelog_directive):
             append_sec = _append_node(changelog_directive)
 
             for rec in bysection[(changelog_directive.default_section, cat)]:
-                rec["id"] = "%s-%s" % (id_prefix, next(counter))
+                rec.id = "%s-%s" % (id_prefix, next(counter))
 
                 _render_rec(changelog_directive, rec, None, cat, append_sec)
 
@@ -50,7 +51,7 @@ def render_changelog(changelog_directive):
 
             for cat in changelog_directive.inner_tag_sort:
                 for rec in bysection[(section, cat)]:
-                    rec["id"] = "%s-%s" % (id_prefix, next(counter))
+                    rec.id = "%s-%s" % (id_prefix, next(counter))
                     _render_rec(
                         changelog_directive, rec, section, cat, append_sec
                     )
@@ -62,41 +63,113 @@ def render_changelog(changelog_directive):
 
 
 def _organize_by_section(changelog_directive, changes):
-    compound_sections = [
-        (s, s.split(" ")) for s in changelog_directive.sections if " " in s
-    ]
+    classify = _classifier_for(
+        changelog_directive.sections, changelog_directive.inner_tag_sort
+    ).classify
 
     bysection = collections.defaultdict(list)
     all_sections = set()
     for rec in changes:
-        assert changelog_directive.version == rec["render_for_version"]
+        assert changelog_directive.version == rec.render_for_version
 
-        inner_tag = rec["tags"].intersection(
-            changelog_directive.inner_tag_sort
-        )
-        if inner_tag:
-            inner_tag = inner_tag.pop()
+        section, inner_tag = classify(rec.sorted_tags)
+        if section is None:
+            section = changelog_directive.default_section
         else:
-            inner_tag = ""
+            all_sections.add(section)
+        bysection[(section, inner_tag)].append(rec)
+    return bysection, all_sections
+
+
+class _SectionClassifier(object):
+    """Assign tag lists to a ``(section, inner tag)`` pair.
+
+    The section is None for tags that don't name any section.
 
-        for compound, comp_words in compound_sections:
-            if rec["tags"].issuperset(comp_words):
-                bysection[(compound, inner_tag)].append(rec)
-                all_sections.add(compound)
-                break
+    Each tag named by the configured sections and inner tags gets a bit;
+    compound sections, such as ``"orm declarative"``, are matched by
+    comparing masks, and the inner tag is the one that comes first in
+    ``changelog_inner_tag_sort``.  Results are memoized per tag list,
+    which are shared between records with the same tags.
+
+    """
+
+    def __init__(self, sections, inner_tag_sort):
+        self.sections = frozenset(sections)
+        self._bits = {}
+
+        self.compound_sections = [
+            (section, self._mask(section.split(" ")))
+            for section in sections
+            if " " in section
+        ]
+
+        # bit i is inner_tag_sort[i], so the lowest bit set is the tag
+        # with the highest priority
+        self.inner_tags = [tag for tag in inner_tag_sort if tag]
+        self.inner_bits = {}
+        for idx, tag in enumerate(self.inner_tags):
+            self.inner_bits.setdefault(tag, 1 << idx)
+
+        self._classified = {}
+
+    def _mask(self, tags, create=True):
+        mask = 0
+        for tag in tags:
+            if not tag:
+                continue
+            bit = self._bits.get(tag)
+            if bit is None:
+                if not create:
+                    continue
+                bit = self._bits[tag] = 1 << len(self._bits)
+            mask |= bit
+        return mask
+
+    def classify(self, sorted_tags):
+        try:
+            return self._classified[sorted_tags]
+        except KeyError:
+            result = self._classified[sorted_tags] = self._classify(
+                sorted_tags
+            )
+            return result
+
+    def _classify(self, sorted_tags):
+        inner_mask = 0
+        for tag in sorted_tags:
+            inner_mask |= self.inner_bits.get(tag, 0)
+        if inner_mask:
+            inner_tag = self.inner_tags[
+                (inner_mask & -inner_mask).bit_length() - 1
+            ]
         else:
-            intersect = rec["tags"].intersection(changelog_directive.sections)
-            if intersect:
-                for sec in rec["sorted_tags"]:
-                    if sec in intersect:
-                        bysection[(sec, inner_tag)].append(rec)
-                        all_sections.add(sec)
-                        break
-            else:
-                bysection[
-                    (changelog_directive.default_section, inner_tag)
-                ].append(rec)
-    return bysection, all_sections
+            inner_tag = ""
+
+        mask = self._mask(sorted_tags, create=False)
+        for compound, compound_mask in self.compound_sections:
+            if mask & compound_mask == compound_mask:
+                return compound, inner_tag
+
+        # otherwise the first of the record's own tags that names a section
+        for tag in sorted_tags:
+            if tag in self.sections:
+                return tag, inner_tag
+        return None, inner_tag
+
+
+# compiled classifiers per configuration, for the life of the process
+_classifiers = {}
+
+
+def _classifier_for(sections, inner_tag_sort):
+    key = (tuple(sections), tuple(inner_tag_sort))
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        classifier = _classifiers[key] = _SectionClassifier(
+            sections, inner_tag_sort
+        )
+    return classifier
 
 
 def _append_node(changelog_directive):
@@ -139,19 +212,36 @@ def _run_top(changelog_directive, id_prefix):
     return topsection
 
 
+def _body_children(body, profiler):
+    """Return the child nodes of a change body to place in the output.
+
+    The first rendering of a body takes its children as they are.  A body
+    rendered again, such as for another version within the same document,
+    gets copies, as a node can only have one parent.
+
+    """
+    if body.children and body.children[0].parent is not body:
+        profiler.count("deepcopies")
+        return [child.deepcopy() for child in body.children]
+    return body.children
+
+
 def _render_rec(changelog_directive, rec, section, cat, append_sec):
-    para = rec["node"].deepcopy()
+    # a new paragraph around the body's children rather than a deep copy
+    # of the body; the tag header, backport note and references are added
+    # to this paragraph only
+    para = rec.node.copy()
 
     targetid = "change-%s" % (
-        rec["version_to_hash"][changelog_directive.version],
+        rec.version_to_hash[changelog_directive.version],
     )
     targetnode = nodes.target("", "", ids=[targetid])
 
     sections = section.split(" ") if section else []
-    section_tags = [tag for tag in sections if tag in rec["tags"]]
-    category_tags = [cat] if cat in rec["tags"] else []
+    section_tags = [tag for tag in sections if tag in rec.tags]
+    category_tags = [cat] if cat in rec.tags else []
     other_tags = list(
-        sorted(rec["tags"].difference(section_tags + category_tags))
+        sorted(rec.tags.difference(section_tags + category_tags))
     )
 
     all_items = []
@@ -176,13 +266,14 @@ def _render_rec(changelog_directive, rec, section, cat, append_sec):
     )
     targetnode.append(permalink)
 
-    para.insert(0, targetnode)
+    para.append(targetnode)
+    para.extend(_body_children(rec.node, changelog_directive.env.profiler))
 
-    if len(rec["versions"]) > 1:
+    if len(rec.versions) > 1:
 
-        backported_changes = rec["sorted_versions"][
-            rec["sorted_versions"].index(changelog_directive.version) + 1 :
-        ]
+        backported_changes = rec.backported_versions(
+            changelog_directive.version
+        )
         if backported_changes:
             backported = nodes.paragraph("")
             backported.append(nodes.Text("This change is also ", ""))
@@ -197,18 +288,14 @@ def _render_rec(changelog_directive, rec, section, cat, append_sec):
 
     i = 0
     for collection, render, prefix in (
+        (rec.tickets, changelog_directive.env.changelog_render_ticket, "#%s"),
         (
-            rec["tickets"],
-            changelog_directive.env.changelog_render_ticket,
-            "#%s",
-        ),
-        (
-            rec["pullreq"],
+            rec.pullreq,
             changelog_directive.env.changelog_render_pullreq,
             "pull request %s",
         ),
         (
-            rec["changeset"],
+            rec.changeset,
             changelog_directive.env.changelog_render_changeset,
             "r%s",
         ),
@@ -240,5 +327,5 @@ def _render_rec(changelog_directive, rec, section, cat, append_sec):
             insert_ticket.append(node)
 
     append_sec.append(
-        nodes.list_item("", nodes.target("", "", ids=[rec["id"]]), para)
+        nodes.list_item("", nodes.target("", "", ids=[rec.id]), para)
     )
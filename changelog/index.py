@@ -0,0 +1,351 @@
+"""A SQLite index of change records, for querying without a docs build.
+
+Each indexed changelog file is stored along with content hashes of the
+file, the files it includes, its notes directories and the config file;
+re-indexing only parses files where one of those has changed.
+
+"""
+import json
+import os
+import sqlite3
+import sys
+
+from . import cache
+from . import export
+from .versionsort import version_key
+
+# bump this when the schema, or what's stored in it, changes; older
+# databases are rebuilt
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE dependencies (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    digest TEXT
+);
+CREATE TABLE records (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    version TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    title TEXT,
+    raw_text TEXT NOT NULL,
+    pullreq TEXT NOT NULL,
+    changeset TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE tags (
+    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE tickets (
+    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+    ticket TEXT NOT NULL
+);
+CREATE TABLE versions (
+    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+    version TEXT NOT NULL
+);
+CREATE INDEX ix_dependencies_file_id ON dependencies (file_id);
+CREATE INDEX ix_records_file_id ON records (file_id);
+CREATE INDEX ix_records_version ON records (version);
+CREATE INDEX ix_tags_tag ON tags (tag, record_id);
+CREATE INDEX ix_tags_record_id ON tags (record_id);
+CREATE INDEX ix_tickets_ticket ON tickets (ticket, record_id);
+CREATE INDEX ix_tickets_record_id ON tickets (record_id);
+CREATE INDEX ix_versions_version ON versions (version, record_id);
+CREATE INDEX ix_versions_record_id ON versions (record_id);
+"""
+
+
+def connect(database):
+    """Open an index database, creating or rebuilding the schema if needed."""
+
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA foreign_keys = ON")
+    (user_version,) = conn.execute("PRAGMA user_version").fetchone()
+    if user_version != SCHEMA_VERSION:
+        with conn:
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            ).fetchall():
+                conn.execute('DROP TABLE "%s"' % name)
+            conn.executescript(_SCHEMA)
+            conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    return conn
+
+
+def _is_current(conn, file_id):
+    dependencies = conn.execute(
+        "SELECT path, digest FROM dependencies WHERE file_id = ?", (file_id,)
+    ).fetchall()
+    return bool(dependencies) and all(
+        cache.dependency_digest(path) == digest
+        for path, digest in dependencies
+    )
+
+
+def index_changelog_files(database, filenames, config_filename=None):
+    """Add changelog files to an index, or update them if they've changed.
+
+    Files whose own content, included files, notes directories and config
+    file all hash the same as when they were last indexed are skipped.
+    Files that were indexed but no longer exist are removed.  Returns the
+    number of files parsed.
+
+    """
+    conn = connect(database)
+    parsed = 0
+    try:
+        for (file_id, path) in conn.execute(
+            "SELECT id, path FROM files"
+        ).fetchall():
+            if not os.path.exists(path):
+                with conn:
+                    conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            row = conn.execute(
+                "SELECT id FROM files WHERE path = ?", (path,)
+            ).fetchone()
+            if row is not None and _is_current(conn, row[0]):
+                continue
+            _index_file(conn, path, config_filename)
+            parsed += 1
+    finally:
+        conn.close()
+    return parsed
+
+
+def _index_file(conn, path, config_filename):
+    # files read before parsing, so that an edit made while parsing is
+    # picked up by the next run rather than lost
+    digests = {path: cache.dependency_digest(path)}
+    if config_filename is not None:
+        config_path = os.path.abspath(config_filename)
+        digests[config_path] = cache.dependency_digest(config_path)
+
+    records = []
+    changelog_env = export._ExportEnvironment(
+        lambda version, rec: records.append(
+            export.record_as_dict(version, rec)
+        ),
+        config_filename,
+    )
+    dependencies = export._publish_records(path, changelog_env)
+    for dep_path in dependencies + changelog_env.notes_dirs:
+        dep_path = os.path.abspath(dep_path)
+        if dep_path not in digests:
+            digests[dep_path] = cache.dependency_digest(dep_path)
+
+    with conn:
+        conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        file_id = conn.execute(
+            "INSERT INTO files (path) VALUES (?)", (path,)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO dependencies (file_id, path, digest) "
+            "VALUES (?, ?, ?)",
+            [
+                (file_id, dep_path, digest)
+                for dep_path, digest in digests.items()
+            ],
+        )
+        for position, record in enumerate(records):
+            record_id = conn.execute(
+                "INSERT INTO records (file_id, version, hash, title, "
+                "raw_text, pullreq, changeset, position) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_id,
+                    record["version"],
+                    record["hash"],
+                    record["title"],
+                    record["raw_text"],
+                    json.dumps(record["pullreq"]),
+                    json.dumps(record["changeset"]),
+                    position,
+                ),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO tags (record_id, tag, position) VALUES (?, ?, ?)",
+                [
+                    (record_id, tag, tag_position)
+                    for tag_position, tag in enumerate(record["tags"])
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO tickets (record_id, ticket) VALUES (?, ?)",
+                [(record_id, ticket) for ticket in record["tickets"]],
+            )
+            conn.executemany(
+                "INSERT INTO versions (record_id, version) VALUES (?, ?)",
+                [(record_id, version) for version in record["versions"]],
+            )
+
+
+def _parse_version_range(version_range):
+    """Parse ``"LOW:HIGH"``; either end may be omitted, both are inclusive."""
+
+    if ":" not in version_range:
+        return version_range, version_range
+    low, high = version_range.split(":", 1)
+    return low.strip() or None, high.strip() or None
+
+
+def query_change_records(
+    database, tickets=(), tags=(), version_range=None, files=()
+):
+    """Return the indexed change records matching all the given criteria.
+
+    ``tickets`` matches records for any of the given tickets; ``tags``
+    matches records having all of the given tags.  ``version_range`` is
+    ``"LOW:HIGH"``, inclusive, where either end may be left out, or a
+    single version; it is compared against the version each record is
+    listed under.  Records are returned as dictionaries in the form of
+    :func:`changelog.export.record_as_dict`, plus a ``"file"`` key, newest
+    version first.
+
+    """
+    conn = connect(database)
+    try:
+        return _query(conn, tickets, tags, version_range, files)
+    finally:
+        conn.close()
+
+
+def _query(conn, tickets, tags, version_range, files):
+    where = []
+    params = []
+    for tag in tags:
+        where.append(
+            "EXISTS (SELECT 1 FROM tags WHERE tags.record_id = records.id "
+            "AND tags.tag = ?)"
+        )
+        params.append(tag)
+    if tickets:
+        where.append(
+            "EXISTS (SELECT 1 FROM tickets "
+            "WHERE tickets.record_id = records.id "
+            "AND tickets.ticket IN (%s))" % ", ".join("?" for _ in tickets)
+        )
+        params.extend(tickets)
+    if files:
+        where.append("files.path IN (%s)" % ", ".join("?" for _ in files))
+        params.extend(os.path.abspath(fname) for fname in files)
+    if version_range is not None:
+        # version strings don't sort in SQL; pick out the matching ones
+        # from the distinct versions present, which is a small set
+        low, high = _parse_version_range(version_range)
+        low = version_key(low) if low is not None else None
+        high = version_key(high) if high is not None else None
+        versions = [
+            version
+            for (version,) in conn.execute(
+                "SELECT DISTINCT version FROM records"
+            )
+            if (low is None or version_key(version) >= low)
+            and (high is None or version_key(version) <= high)
+        ]
+        where.append(
+            "records.version IN (%s)" % ", ".join("?" for _ in versions)
+        )
+        params.extend(versions)
+
+    # the tag, ticket and version lists come back joined with a unit
+    # separator, rather than with a query per record
+    rows = conn.execute(
+        "SELECT files.path, records.version, records.hash, records.title, "
+        "records.raw_text, records.pullreq, records.changeset, "
+        "(SELECT group_concat(tag, char(31)) FROM (SELECT tag FROM tags "
+        "WHERE tags.record_id = records.id ORDER BY position)), "
+        "(SELECT group_concat(ticket, char(31)) FROM tickets "
+        "WHERE tickets.record_id = records.id), "
+        "(SELECT group_concat(version, char(31)) FROM versions "
+        "WHERE versions.record_id = records.id) "
+        "FROM records JOIN files ON files.id = records.file_id"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY files.path, records.position",
+        params,
+    ).fetchall()
+
+    results = [
+        {
+            "file": path,
+            "version": version,
+            "hash": hash_,
+            "title": title,
+            "tags": _split(tags),
+            "tickets": sorted(_split(tickets)),
+            "pullreq": json.loads(pullreq),
+            "changeset": json.loads(changeset),
+            "versions": sorted(
+                _split(versions), key=version_key, reverse=True
+            ),
+            "raw_text": raw_text,
+        }
+        for (
+            path,
+            version,
+            hash_,
+            title,
+            raw_text,
+            pullreq,
+            changeset,
+            tags,
+            tickets,
+            versions,
+        ) in rows
+    ]
+    # stable, so document order is kept within a version
+    results.sort(
+        key=lambda record: version_key(record["version"]), reverse=True
+    )
+    return results
+
+
+def _split(joined):
+    return joined.split("\x1f") if joined else []
+
+
+def print_change_records(
+    database, tickets, tags, version_range, files, as_json
+):
+    records = query_change_records(
+        database,
+        tickets=tickets or (),
+        tags=tags or (),
+        version_range=version_range,
+        files=files or (),
+    )
+    if as_json:
+        encoder = json.JSONEncoder(ensure_ascii=False, sort_keys=True)
+        for record in records:
+            sys.stdout.write(encoder.encode(record) + "\n")
+        return
+
+    for record in records:
+        sys.stdout.write(
+            "%s\t%s\t%s\t%s\n"
+            % (
+                record["version"],
+                ", ".join(record["tags"]),
+                ", ".join(record["tickets"]),
+                record["title"] or record["raw_text"].split("\n", 1)[0],
+            )
+        )
+
+
+def build_index(database, filenames, config_filename):
+    parsed = index_changelog_files(database, filenames, config_filename)
+    sys.stderr.write(
+        "indexed %d of %d file(s) into %s\n"
+        % (parsed, len(filenames), database)
+    )
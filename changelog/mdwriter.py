@@ -1,13 +1,26 @@
+import concurrent.futures
+import glob
 import io
+import itertools
+import os
+import sys
 
 from docutils import nodes
+from docutils import statemachine
 from docutils import writers
 from docutils.core import publish_file
 from docutils.core import publish_string
+from docutils.parsers import rst
+from docutils.parsers.rst import roles
+from docutils.parsers.rst import states
 
+from . import cache
+from .blocks import split_version_blocks
+from .blocks import version_line_ranges
 from .docutils import setup_docutils
 from .environment import DefaultEnvironment
 from .environment import Environment
+from .environment import load_config
 
 
 class Writer(writers.Writer):
@@ -23,10 +36,29 @@ class Writer(writers.Writer):
         translator = MarkdownTranslator(
             self.document, self.limit_version, self.receive_sections
         )
-        self.document.walkabout(translator)
+        profiler = Environment.from_document_settings(
+            self.document.settings
+        ).profiler
+        with profiler.span("translate markdown"):
+            self.document.walkabout(translator)
         self.output = translator.output_buf.getvalue()
 
 
+class _DocumentWriter(writers.Writer):
+    """Keep the transformed document for translating piece by piece.
+
+    Unlike ``publish_doctree()``, going through a regular writer applies
+    the same transforms, such as filtering of system messages, that the
+    markdown writer sees.
+
+    """
+
+    supported = ("markdown",)
+
+    def translate(self):
+        self.output = ""
+
+
 class MarkdownTranslator(nodes.NodeVisitor):
     def __init__(self, document, limit_version, receive_sections):
         super(MarkdownTranslator, self).__init__(document)
@@ -54,7 +86,10 @@ class MarkdownTranslator(nodes.NodeVisitor):
         # http://docutils.sourceforge.net/FAQ.html\
         # #how-can-i-indicate-the-document-title-subtitle
         for subnode in document_node:
-            if "version_string" in subnode.attributes:
+            if (
+                isinstance(subnode, nodes.Element)
+                and "version_string" in subnode.attributes
+            ):
                 if isinstance(subnode, nodes.subtitle):
                     return subnode
                 elif isinstance(subnode, nodes.section):
@@ -69,31 +104,109 @@ class MarkdownTranslator(nodes.NodeVisitor):
         self.document = node
         self.env = Environment.from_document_settings(self.document.settings)
 
-        subtitle_node = self._detect_section_was_squashed_into_subtitle(node)
-        if subtitle_node:
-            version = subtitle_node.attributes["version_string"]
-            rebuild_our_lost_section = nodes.section(
-                "",
-                nodes.title(version, version, classes=["release-version"]),
-                **subtitle_node.attributes
+        if self.limit_version:
+            # sections of the version still to be written; the traversal
+            # stops after the last one
+            self._limit_remaining = self.version_strings().count(
+                self.limit_version
             )
 
-            # note we are taking the nodes from the document and moving them
-            # into the new section.   nodes have a "parent" which means that
-            # parent changes, which means we are mutating the internal
-            # state of the document node.  so use deepcopy() to avoid this
-            # side effect; deepcopy() for these nodes seems to not be a
-            # performance problem.
-            rebuild_our_lost_section.extend([n.deepcopy() for n in node[2:]])
-            rebuild_our_lost_section.walkabout(self)
+        subtitle_node = self._detect_section_was_squashed_into_subtitle(node)
+        if subtitle_node:
+            self._walk_squashed_section(node, subtitle_node)
             raise nodes.SkipNode()
 
+    def _walk_squashed_section(self, document_node, subtitle_node):
+        version = subtitle_node.attributes["version_string"]
+        rebuild_our_lost_section = nodes.section(
+            "",
+            nodes.title(version, version, classes=["release-version"]),
+            **subtitle_node.attributes
+        )
+
+        # walk the nodes following the title and subtitle as though
+        # they were inside of the section.  nodes have a "parent", so
+        # moving them into the new section would mutate the document;
+        # visiting them in place avoids both that and copying them.
+        self.visit_section(rebuild_our_lost_section)
+        rebuild_our_lost_section[0].walkabout(self)
+        for subnode in document_node[2:]:
+            subnode.walkabout(self)
+        self.depart_section(rebuild_our_lost_section)
+
+    def iter_version_sections(self, versions=None):
+        """Translate the document one version section at a time.
+
+        Yields ``(version, markdown)`` tuples, each one as soon as its
+        section has been translated; sections for versions not in
+        ``versions`` are not visited at all.
+
+        """
+        received = []
+
+        def receive_sections(version_string, text):
+            received.append((version_string, text))
+
+        self.receive_sections = receive_sections
+        self._standalone_section_display = True
+        self.disable_writing()
+
+        document = self.document
+        candidates = self.version_nodes()
+
+        profiler = Environment.from_document_settings(
+            document.settings
+        ).profiler
+        for version_node, walk_node in candidates:
+            version = version_node.attributes["version_string"]
+            if versions is not None and version not in versions:
+                continue
+            with profiler.span("translate markdown", version):
+                if walk_node is document:
+                    self._walk_squashed_section(document, version_node)
+                else:
+                    walk_node.walkabout(self)
+            while received:
+                yield received.pop(0)
+
+    def version_nodes(self):
+        """Return ``(node with the version string, node to walk)`` per
+        version section, in document order.
+
+        The node to walk is the document itself for a section that was
+        squashed into the document subtitle.
+
+        """
+        document = self.document
+        subtitle_node = self._detect_section_was_squashed_into_subtitle(
+            document
+        )
+        if subtitle_node:
+            return [(subtitle_node, document)]
+        else:
+            return [
+                (section, section)
+                for section in document.traverse(nodes.section)
+                if "version_string" in section.attributes
+            ]
+
+    def version_strings(self):
+        """Return the version of each version section, in document order."""
+
+        return [
+            version_node.attributes["version_string"]
+            for version_node, walk_node in self.version_nodes()
+        ]
+
     def visit_standalone_version_node(self, node, version_string):
         """visit a section or document that has a changelog version string
         at the top"""
 
         if self.limit_version and self.limit_version != version_string:
-            return
+            # nothing inside of another version is written.  for a
+            # squashed section this propagates out of visit_document(),
+            # which skips the document all the same
+            raise nodes.SkipNode()
 
         self.section_level = 1
         self.enable_writing()
@@ -104,13 +217,15 @@ class MarkdownTranslator(nodes.NodeVisitor):
         """depart a section or document that has a changelog version string
         at the top"""
 
-        if self.limit_version and self.limit_version != version_string:
-            return
-
         if self.receive_sections:
             self.receive_sections(version_string, self.buf.getvalue())
         self.disable_writing()
 
+        if self.limit_version:
+            self._limit_remaining -= 1
+            if not self._limit_remaining:
+                raise nodes.StopTraversal()
+
     def visit_section(self, node):
         if (
             "version_string" in node.attributes
@@ -224,66 +339,422 @@ class MarkdownTranslator(nodes.NodeVisitor):
             raise AttributeError(name)
 
 
-def stream_changelog_sections(
-    target_filename, config_filename, receive_sections, version=None
-):
-    """Send individual changelog sections to a callable, one per version.
-
-    The callable accepts two arguments, the string version number of the
-    changelog section, and the markdown-formatted content of the changelog
-    section.
+class _SliceParser(rst.Parser):
+    """Parse selected line ranges of a file.
 
-    Used for APIs that receive changelog sections per version.
+    The lines given to the state machine keep their position in the file,
+    so that messages about them refer to the right line.  This follows
+    ``rst.Parser.parse()``, which only accepts a whole string.
 
     """
+
+    def __init__(self, line_ranges):
+        super(_SliceParser, self).__init__()
+        self.line_ranges = line_ranges
+
+    def parse(self, inputstring, document):
+        self.setup_parse(inputstring, document)
+        self.document.settings.setdefault("tab_width", 8)
+        self.document.settings.setdefault("syntax_highlight", "long")
+        self.statemachine = states.RSTStateMachine(
+            state_classes=self.state_classes,
+            initial_state=self.initial_state,
+            debug=document.reporter.debug_flag,
+        )
+        lines = statemachine.string2lines(
+            inputstring,
+            tab_width=document.settings.tab_width,
+            convert_whitespace=True,
+        )
+        source = document["source"]
+        input_lines = statemachine.StringList()
+        for start, end in self.line_ranges:
+            if input_lines:
+                # in place of the blocks left out
+                input_lines.append("", source, start - 1)
+            input_lines.extend(
+                statemachine.StringList(
+                    lines[start:end],
+                    items=list(
+                        zip(itertools.repeat(source), range(start, end))
+                    ),
+                )
+            )
+        self.statemachine.run(input_lines, document, inliner=self.inliner)
+        # restore the "default" default role after parsing a document
+        if "" in roles._roles:
+            del roles._roles[""]
+        self.finish_parse()
+
+
+def _parser_for(target_filename, changelog_env, text):
+    """Return a parser that skips the blocks of versions that aren't
+    rendered and can't affect those that are, or None to parse all of
+    the file."""
+
+    if changelog_env.render_versions is None:
+        return None
+    with changelog_env.profiler.span("slice", target_filename):
+        blocks, lines = split_version_blocks(text)
+        return _SliceParser(
+            version_line_ranges(
+                blocks,
+                len(lines),
+                changelog_env.render_versions,
+                os.path.dirname(target_filename),
+            )
+        )
+
+
+def _publish_doctree(target_filename, changelog_env, text=None):
     Environment.register(DefaultEnvironment)
 
     setup_docutils()
-    with open(target_filename, encoding="utf-8") as handle:
+    writer = _DocumentWriter()
+    if text is None:
+        with open(target_filename, encoding="utf-8") as handle:
+            text = handle.read()
+    parser = _parser_for(target_filename, changelog_env, text)
+    with changelog_env.profiler.span("publish", target_filename):
         publish_string(
-            handle.read(),
+            text,
             source_path=target_filename,
-            writer=Writer(
-                limit_version=version, receive_sections=receive_sections
-            ),
+            writer=writer,
+            parser=parser,
             settings_overrides={
-                "changelog_env": DefaultEnvironment(config_filename),
+                "changelog_env": changelog_env,
                 "report_level": 3,
             },
         )
+    return writer.document
+
+
+class _SectionCacheEnvironment(DefaultEnvironment):
+    def __init__(self, config):
+        super(_SectionCacheEnvironment, self).__init__(config=config)
+        self.notes_dirs = []
+
+    def note_notes_files(self, path, fnames):
+        self.notes_dirs.append(path)
+
+
+def _iter_sections(target_filename, changelog_env, versions):
+    cache_dir = changelog_env.changelog_output_cache_dir
+    if cache_dir:
+        return _iter_cached_sections(
+            target_filename, changelog_env, versions, cache_dir
+        )
+    return _iter_published_sections(target_filename, changelog_env, versions)
+
+
+def _iter_published_sections(
+    target_filename, changelog_env, versions, dependencies=None
+):
+    changelog_env.render_versions = versions
+    document = _publish_doctree(target_filename, changelog_env)
+    if dependencies is not None:
+        # the files read in by .. include:: directives, including those
+        # replayed from an earlier parse of a .. changelog_imports::
+        dependencies.extend(document.settings.record_dependencies.list)
+    translator = MarkdownTranslator(document, None, None)
+    for version, text in translator.iter_version_sections(versions):
+        yield version, text
+
+
+def _iter_cached_sections(target_filename, changelog_env, versions, cache_dir):
+    """Yield version sections, serving those unchanged from the cache.
+
+    The file is only parsed if one of the versions wanted isn't current
+    in the cache, and then only those versions are translated.
+
+    """
+    with open(target_filename, encoding="utf-8") as handle:
+        text = handle.read()
+    blocks, lines = split_version_blocks(text)
+    section_cache = cache.SectionCache(
+        cache_dir,
+        target_filename,
+        cache.config_key(changelog_env),
+        blocks,
+        lines,
+    )
+    wanted = [
+        version
+        for version in section_cache.versions
+        if versions is None or version in versions
+    ]
+    cached = {}
+    for version in wanted:
+        cached_text = section_cache.get(version)
+        if cached_text is not None:
+            cached[version] = cached_text
+
+    # nothing wanted may also mean directives the source text scan didn't
+    # find, so the file is parsed to be sure
+    parse = not wanted or len(cached) < len(wanted)
+
+    profiler = changelog_env.profiler
+    hits = misses = 0
+    try:
+        if parse:
+            render_versions = versions
+            if wanted:
+                render_versions = set(
+                    version for version in wanted if version not in cached
+                )
+            recording_env = _SectionCacheEnvironment(changelog_env.config)
+            recording_env.render_versions = render_versions
+            document = _publish_doctree(target_filename, recording_env, text)
+            translator = MarkdownTranslator(document, None, None)
+            if translator.version_strings() != [
+                version
+                for version in section_cache.versions
+                if render_versions is None or version in render_versions
+            ]:
+                # the directives weren't all found in the source text;
+                # translate everything and leave the cache alone
+                cached = {}
+                section_cache = None
+                if render_versions != versions:
+                    recording_env = _SectionCacheEnvironment(
+                        changelog_env.config
+                    )
+                    recording_env.render_versions = versions
+                    document = _publish_doctree(
+                        target_filename, recording_env, text
+                    )
+                    translator = MarkdownTranslator(document, None, None)
+                wanted = translator.version_strings()
+            fresh = translator.iter_version_sections(
+                set(version for version in wanted if version not in cached)
+            )
+        for version in wanted:
+            if version in cached:
+                hits += 1
+                yield version, cached[version]
+            else:
+                misses += 1
+                version, section_text = next(fresh)
+                if section_cache is not None:
+                    section_cache.put(version, section_text)
+                yield version, section_text
+        if parse and section_cache is not None:
+            section_cache.save(
+                document.settings.record_dependencies.list
+                + recording_env.notes_dirs
+            )
+    finally:
+        profiler.count("output cache hits", hits)
+        profiler.count("output cache misses", misses)
+
+
+def iter_changelog_sections(target_filename, config_filename, versions=None):
+    """Render a changelog file to markdown, one version at a time.
+
+    Yields ``(version, markdown)`` tuples in document order, each one as
+    soon as that version's section has been translated, so that only one
+    section's markdown is held in memory at a time.  If ``versions`` is
+    given, only the sections for those version strings are translated.
+
+    """
+    return _iter_sections(
+        target_filename, DefaultEnvironment(config_filename), versions
+    )
+
+
+def stream_changelog_sections(
+    target_filename, config_filename, receive_sections, version=None
+):
+    """Send individual changelog sections to a callable, one per version.
+
+    The callable accepts two arguments, the string version number of the
+    changelog section, and the markdown-formatted content of the changelog
+    section.
+
+    Used for APIs that receive changelog sections per version.
+
+    """
+    for version_string, text in iter_changelog_sections(
+        target_filename,
+        config_filename,
+        versions=[version] if version else None,
+    ):
+        receive_sections(version_string, text)
 
 
 def render_changelog_as_md(
     target_filename, config_filename, version, sections_only
 ):
+    _render_changelog_as_md(
+        target_filename,
+        DefaultEnvironment(config_filename),
+        version,
+        sections_only,
+        sys.stdout,
+    )
 
-    Environment.register(DefaultEnvironment)
 
-    setup_docutils()
+def _render_changelog_as_md(
+    target_filename, changelog_env, version, sections_only, destination
+):
+    if version and changelog_env.changelog_output_cache_dir:
+        # a single version renders the same as its section
+        for version_string, text in _iter_sections(
+            target_filename, changelog_env, versions=[version]
+        ):
+            destination.write(text + "\n" if sections_only else text)
+            destination.flush()
+        return
 
     if sections_only:
+        for version_string, text in _iter_sections(
+            target_filename,
+            changelog_env,
+            versions=[version] if version else None,
+        ):
+            destination.write(text + "\n")
+            destination.flush()
+        return
 
-        def receive_sections(version_string, text):
-            print(text)
+    Environment.register(DefaultEnvironment)
 
-    else:
-        receive_sections = None
+    setup_docutils()
 
-    writer = Writer(limit_version=version, receive_sections=receive_sections)
-    settings_overrides = {
-        "changelog_env": DefaultEnvironment(config_filename),
-        "report_level": 3,
-    }
+    if version:
+        # other versions are still parsed, as their changes may name
+        # this version, but their nodes aren't built
+        changelog_env.render_versions = [version]
+    writer = Writer(limit_version=version)
+    settings_overrides = {"changelog_env": changelog_env, "report_level": 3}
 
     with open(target_filename, encoding="utf-8") as handle:
-        if receive_sections:
-            publish_string(
-                handle.read(),
-                source_path=target_filename,
-                writer=writer,
-                settings_overrides=settings_overrides,
+        text = handle.read()
+    parser = _parser_for(target_filename, changelog_env, text)
+    with changelog_env.profiler.span("publish", target_filename):
+        publish_file(
+            io.StringIO(text),
+            source_path=target_filename,
+            destination=destination,
+            writer=writer,
+            parser=parser,
+            settings_overrides=settings_overrides,
+        )
+
+
+# conf.py namespace, loaded once per worker process
+_worker_config = None
+
+
+def _init_worker(config_filename):
+    global _worker_config
+    _worker_config = load_config(config_filename)
+
+
+def _render_file_as_md(
+    target_filename, output_filename, version, sections_only
+):
+    try:
+        with open(output_filename, "w", encoding="utf-8") as destination:
+            _render_changelog_as_md(
+                target_filename,
+                DefaultEnvironment(config=_worker_config),
+                version,
+                sections_only,
+                destination,
             )
+    except Exception as err:
+        if os.path.exists(output_filename):
+            os.unlink(output_filename)
+        # exceptions from docutils don't necessarily pickle, so send
+        # back a message rather than the exception itself
+        return "%s: %s" % (type(err).__name__, err)
+    else:
+        return None
+
+
+def render_changelogs_as_md(
+    filenames, config_filename, output_dir, version, sections_only, jobs=1
+):
+    """Render many changelog files to markdown, optionally in parallel.
+
+    Each of ``filenames`` may also be a glob pattern.  With a single file
+    and no ``output_dir``, the markdown goes to stdout as with
+    :func:`.render_changelog_as_md`; otherwise each file is rendered to a
+    ``.md`` file of the same base name in ``output_dir``.  The config file
+    is loaded once per process.  Errors are reported per file on stderr;
+    returns 1 if any file failed and 0 otherwise, for use as the exit
+    status.
+
+    Raises ``ValueError`` for a pattern matching no files, for more than
+    one file without ``output_dir``, and for files that would be written
+    to the same output file.
+
+    """
+    targets = []
+    seen = set()
+    for pattern in filenames:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError("no files match %s" % pattern)
         else:
-            publish_file(
-                handle, writer=writer, settings_overrides=settings_overrides
+            matches = [pattern]
+        for target_filename in matches:
+            if os.path.abspath(target_filename) not in seen:
+                seen.add(os.path.abspath(target_filename))
+                targets.append(target_filename)
+
+    if output_dir is None:
+        if len(targets) != 1:
+            raise ValueError(
+                "an output directory (-o) is required when rendering "
+                "more than one file"
             )
+        render_changelog_as_md(
+            targets[0], config_filename, version, sections_only
+        )
+        return 0
+
+    tasks = []
+    outputs = {}
+    for target_filename in targets:
+        output_filename = os.path.join(
+            output_dir,
+            os.path.splitext(os.path.basename(target_filename))[0] + ".md",
+        )
+        if output_filename in outputs:
+            raise ValueError(
+                "%s and %s would both be written to %s"
+                % (outputs[output_filename], target_filename, output_filename)
+            )
+        outputs[output_filename] = target_filename
+        tasks.append(
+            (target_filename, output_filename, version, sections_only)
+        )
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if jobs > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(config_filename,),
+        ) as executor:
+            errors = list(executor.map(_render_file_as_md, *zip(*tasks)))
+    else:
+        _init_worker(config_filename)
+        errors = [_render_file_as_md(*task) for task in tasks]
+
+    failed = 0
+    for (target_filename, output_filename, _, _), error in zip(tasks, errors):
+        if error is not None:
+            failed += 1
+            sys.stderr.write("%s: %s\n" % (target_filename, error))
+        else:
+            sys.stderr.write("%s -> %s\n" % (target_filename, output_filename))
+    if failed:
+        # not the count itself, as exit statuses wrap around at 256
+        sys.stderr.write("%d of %d file(s) failed\n" % (failed, len(tasks)))
+        return 1
+    return 0
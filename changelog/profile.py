@@ -0,0 +1,302 @@
+"""Timing spans and counters for the phases of a changelog build.
+
+The environment's :attr:`.Environment.profiler` is a :class:`.Profiler`
+when profiling is turned on, through the ``changelog_profile_output``
+setting or the ``--profile`` command line option, and the no-op
+:data:`.NULL_PROFILER` otherwise::
+
+    with env.profiler.span("organize sections"):
+        ...
+    env.profiler.count("merges")
+
+The data is written as a Chrome trace-event JSON file, which can be
+loaded in ``chrome://tracing`` or https://ui.perfetto.dev, and summarized
+as a text table.
+
+"""
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+# slowest fragments listed in the summary
+SLOWEST_FRAGMENTS = 10
+
+
+class _Span(object):
+    __slots__ = ("profiler", "name", "detail", "start")
+
+    def __init__(self, profiler, name, detail):
+        self.profiler = profiler
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *arg):
+        self.profiler.add_span(
+            self.name, self.start, time.perf_counter(), self.detail
+        )
+
+
+class _FragmentSpan(_Span):
+    __slots__ = ()
+
+    def __exit__(self, *arg):
+        end = time.perf_counter()
+        self.profiler.add_span(self.name, self.start, end, self.detail)
+        self.profiler.note_fragment(self.detail, end - self.start)
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *arg):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullProfiler(object):
+    """A profiler that records nothing."""
+
+    enabled = False
+
+    def span(self, name, detail=None):
+        return _NULL_SPAN
+
+    def count(self, name, value=1):
+        pass
+
+    def fragment(self, path):
+        return _NULL_SPAN
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(object):
+    """Collect spans, counters and per-fragment timings.
+
+    Everything recorded is tagged with the id of the process it was
+    recorded in, so that data from the worker processes of a parallel
+    Sphinx build can be merged into that of the main process with
+    :meth:`.merge`.
+
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.counters = {}
+        self.fragments = []
+
+    def span(self, name, detail=None):
+        """Return a context manager timing the block it wraps."""
+
+        return _Span(self, name, detail)
+
+    def add_span(self, name, start, end, detail=None):
+        self.events.append(
+            (name, start, end - start, os.getpid(), _thread_id(), detail)
+        )
+
+    def count(self, name, value=1):
+        counters = self.counters.setdefault(os.getpid(), {})
+        counters[name] = counters.get(name, 0) + value
+
+    def fragment(self, path):
+        """Return a context manager timing the reading or the parsing of a
+        single fragment file, for the list of slowest fragments.
+
+        A fragment is typically read in a worker thread and parsed later
+        on; the times recorded for the same file are added up.
+
+        """
+
+        return _FragmentSpan(self, "fragment", path)
+
+    def note_fragment(self, path, seconds):
+        """Record time taken reading or parsing a single fragment file."""
+
+        self.fragments.append((seconds, path, os.getpid()))
+
+    def merge(self, other):
+        """Add the data ``other`` recorded in processes not seen yet.
+
+        A worker process starts out with a copy of the data recorded so
+        far, so only data from processes that aren't already present is
+        taken.
+
+        """
+        known = set([os.getpid()])
+        known.update(event[3] for event in self.events)
+        known.update(self.counters)
+        known.update(entry[2] for entry in self.fragments)
+
+        self.events.extend(
+            event for event in other.events if event[3] not in known
+        )
+        for pid, counters in other.counters.items():
+            if pid not in known:
+                self.counters[pid] = dict(counters)
+        self.fragments.extend(
+            entry for entry in other.fragments if entry[2] not in known
+        )
+
+    def totals(self):
+        """Return ``{span name: (calls, total seconds)}``."""
+
+        totals = {}
+        for name, start, duration, pid, tid, detail in self.events:
+            calls, total = totals.get(name, (0, 0.0))
+            totals[name] = (calls + 1, total + duration)
+        return totals
+
+    def counter_totals(self):
+        totals = collections.Counter()
+        for counters in self.counters.values():
+            totals.update(counters)
+        return totals
+
+    def slowest_fragments(self, limit=SLOWEST_FRAGMENTS):
+        """Return ``(seconds, path)`` for the fragments that took the
+        longest to read and parse, slowest first."""
+
+        totals = collections.Counter()
+        for seconds, path, pid in self.fragments:
+            totals[path] += seconds
+        return sorted(
+            ((seconds, path) for path, seconds in totals.items()), reverse=True
+        )[:limit]
+
+    def chrome_trace(self):
+        """Return the data as a Chrome trace-event document."""
+
+        if self.events:
+            origin = min(event[1] for event in self.events)
+        else:
+            origin = 0.0
+        end = max(
+            [event[1] + event[2] - origin for event in self.events] or [0.0]
+        )
+
+        trace_events = []
+        for name, start, duration, pid, tid, detail in self.events:
+            event = {
+                "name": name,
+                "cat": "changelog",
+                "ph": "X",
+                "ts": (start - origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            if detail is not None:
+                event["args"] = {"detail": detail}
+            trace_events.append(event)
+        for pid, counters in self.counters.items():
+            trace_events.append(
+                {
+                    "name": "counters",
+                    "cat": "changelog",
+                    "ph": "C",
+                    "ts": end * 1e6,
+                    "pid": pid,
+                    "args": counters,
+                }
+            )
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, "w") as handle:
+            json.dump(self.chrome_trace(), handle)
+
+    def summary(self):
+        """Return a text table of the time spent per phase, the counters
+        and the slowest fragments.
+
+        Times are inclusive; a phase that runs inside another, such as
+        the parsing of change bodies within that of a changelog, is
+        counted in both.
+
+        """
+        lines = [
+            "%-32s %8s %10s %10s" % ("phase", "calls", "total ms", "mean ms")
+        ]
+        for name, (calls, total) in sorted(
+            self.totals().items(), key=lambda item: item[1][1], reverse=True
+        ):
+            lines.append(
+                "%-32s %8d %10.1f %10.3f"
+                % (name, calls, total * 1e3, total * 1e3 / calls)
+            )
+
+        counters = self.counter_totals()
+        if counters:
+            lines.append("")
+            lines.append("%-32s %8s" % ("counter", "value"))
+            for name, value in sorted(counters.items()):
+                lines.append("%-32s %8d" % (name, value))
+
+        slowest = self.slowest_fragments()
+        if slowest:
+            lines.append("")
+            lines.append("slowest fragments:")
+            for seconds, path in slowest:
+                lines.append("%10.3f ms  %s" % (seconds * 1e3, path))
+        return "\n".join(lines)
+
+    def dump(self, filename, stream=None):
+        """Write the Chrome trace to ``filename`` and the summary table to
+        ``stream``, stderr by default."""
+
+        self.write_chrome_trace(filename)
+        if stream is None:
+            stream = sys.stderr
+        stream.write(self.summary() + "\n")
+        stream.write("changelog profile written to %s\n" % filename)
+
+
+def _thread_id():
+    try:
+        return threading.get_native_id()
+    except AttributeError:
+        return threading.current_thread().ident
+
+
+# profiler shared by all DefaultEnvironments in this process
+_process_profiler = None
+
+
+def enable(filename):
+    """Turn on profiling for this process.
+
+    Returns the process-wide :class:`.Profiler`, which writes its data to
+    ``filename`` when the process exits.  Calling this again returns the
+    same profiler.
+
+    """
+    global _process_profiler
+    if _process_profiler is None:
+        _process_profiler = Profiler()
+        atexit.register(_process_profiler.dump, filename)
+    return _process_profiler
+
+
+def process_profiler():
+    """Return the process-wide profiler, or :data:`.NULL_PROFILER`."""
+
+    if _process_profiler is None:
+        return NULL_PROFILER
+    return _process_profiler
@@ -0,0 +1,369 @@
+"""Publish per-version changelog sections to an HTTP endpoint.
+
+Sections come from :func:`.mdwriter.iter_changelog_sections` and are sent
+by a bounded number of concurrent asyncio workers, each reusing its own
+HTTP connection.  A state file records a content hash per version, so that
+each run only sends the sections that are new or have changed since the
+last successful run::
+
+    changelog publish doc/build/changelog/changelog_14.rst -c conf.py \\
+        --url https://example.com/api/releases/{version} --method PUT \\
+        --header "Authorization: token $TOKEN" --state .publish-state.json
+
+Where to send things is pluggable; :class:`.HTTPTarget` is the default,
+and anything implementing :class:`.Target` may be passed to
+:func:`.publish_changelog_sections` instead.
+
+"""
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import urllib.parse
+
+from . import mdwriter
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+
+class PublishError(Exception):
+    """A section could not be published.
+
+    ``retry`` indicates whether trying again later might succeed.
+
+    """
+
+    def __init__(self, message, retry=False, retry_after=None):
+        super(PublishError, self).__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class Target(object):
+    """Where sections are sent.
+
+    :meth:`.send` is called concurrently, from up to ``concurrency``
+    workers at once; ``worker`` is the number of the calling worker, for
+    targets that keep a resource such as a connection per worker.  Raise
+    :class:`.PublishError` to report a failure.
+
+    """
+
+    async def open(self, concurrency):
+        pass
+
+    async def send(self, worker, version, text):
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class HTTPTarget(Target):
+    """Send each section as a JSON request body.
+
+    ``url`` may include ``{version}``.  The body is
+    ``{"version": <version>, "body": <markdown>}`` unless a ``payload``
+    callable taking ``(version, text)`` and returning a JSON-serializable
+    object is given.  Each worker keeps one connection open per host, and
+    requests run in the event loop's default executor as they use
+    :mod:`http.client`.
+
+    """
+
+    def __init__(
+        self, url, method="POST", headers=None, payload=None, timeout=30
+    ):
+        self.url = url
+        self.method = method
+        self.headers = dict(headers or {})
+        self.headers.setdefault("Content-Type", "application/json")
+        self.payload = payload or (
+            lambda version, text: {"version": version, "body": text}
+        )
+        self.timeout = timeout
+        self._connections = {}
+
+    async def open(self, concurrency):
+        self._connections = {}
+
+    def _connection(self, worker, url):
+        parsed = urllib.parse.urlsplit(url)
+        key = (worker, parsed.scheme, parsed.netloc)
+        conn = self._connections.get(key)
+        if conn is None:
+            if parsed.scheme == "https":
+                conn = http.client.HTTPSConnection(
+                    parsed.netloc, timeout=self.timeout
+                )
+            elif parsed.scheme == "http":
+                conn = http.client.HTTPConnection(
+                    parsed.netloc, timeout=self.timeout
+                )
+            else:
+                raise PublishError("unsupported URL scheme in %s" % url)
+            self._connections[key] = conn
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        return key, conn, path
+
+    def _request(self, worker, version, text):
+        url = self.url.replace(
+            "{version}", urllib.parse.quote(version, safe="")
+        )
+        key, conn, path = self._connection(worker, url)
+        body = json.dumps(self.payload(version, text)).encode("utf-8")
+        try:
+            conn.request(self.method, path, body=body, headers=self.headers)
+            response = conn.getresponse()
+            response_body = response.read()
+        except (OSError, http.client.HTTPException) as err:
+            conn.close()
+            del self._connections[key]
+            raise PublishError(
+                "%s %s: %s" % (self.method, url, err), retry=True
+            )
+
+        if response.getheader("Connection", "").lower() == "close":
+            conn.close()
+            del self._connections[key]
+
+        if 200 <= response.status < 300:
+            return
+        retry_after = response.getheader("Retry-After")
+        try:
+            retry_after = float(retry_after)
+        except (TypeError, ValueError):
+            retry_after = None
+        raise PublishError(
+            "%s %s: HTTP %d %s"
+            % (
+                self.method,
+                url,
+                response.status,
+                response_body[:200].decode("utf-8", "replace"),
+            ),
+            retry=response.status in RETRY_STATUSES,
+            retry_after=retry_after,
+        )
+
+    async def send(self, worker, version, text):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._request, worker, version, text)
+
+    async def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
+
+
+class PublishState(object):
+    """Content hashes of the sections published so far, per version."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hashes = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename, encoding="utf-8") as handle:
+                self.hashes = json.load(handle).get("versions", {})
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def is_current(self, version, text):
+        return self.hashes.get(version) == self.content_hash(text)
+
+    def mark_published(self, version, text):
+        self.hashes[version] = self.content_hash(text)
+
+    def save(self):
+        if self.filename is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(
+                    {"versions": self.hashes}, handle, indent=2, sort_keys=True
+                )
+                handle.write("\n")
+            os.replace(tmpname, self.filename)
+        except:  # noqa
+            os.unlink(tmpname)
+            raise
+
+
+class PublishResult(object):
+    def __init__(self):
+        self.sent = []
+        self.unchanged = []
+        self.failed = []
+
+    def __repr__(self):
+        return "PublishResult(sent=%d, unchanged=%d, failed=%d)" % (
+            len(self.sent),
+            len(self.unchanged),
+            len(self.failed),
+        )
+
+
+async def publish_sections(
+    sections, target, state, concurrency=4, retries=4, backoff=0.5, force=False
+):
+    """Send ``(version, text)`` pairs to ``target``.
+
+    Sections whose content hash matches ``state`` are skipped unless
+    ``force`` is set.  Failures that may be temporary are retried up to
+    ``retries`` times, waiting ``backoff`` seconds doubled on each attempt,
+    with jitter, or as long as the server asked for with ``Retry-After``.
+    ``state`` is updated as each section is sent.  Any other exception
+    raised by the target fails the section it was sending.  Returns a
+    :class:`.PublishResult`.
+
+    """
+    result = PublishResult()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker(num):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                version, text = item
+                try:
+                    await _send_with_retry(
+                        target, num, version, text, retries, backoff
+                    )
+                except PublishError as err:
+                    result.failed.append((version, str(err)))
+                except Exception as err:
+                    # a worker that died would leave the queue full
+                    result.failed.append(
+                        (version, "%s: %s" % (type(err).__name__, err))
+                    )
+                else:
+                    state.mark_published(version, text)
+                    result.sent.append(version)
+            finally:
+                queue.task_done()
+
+    await target.open(concurrency)
+    workers = [
+        asyncio.ensure_future(worker(num)) for num in range(concurrency)
+    ]
+    try:
+        for version, text in sections:
+            if not force and state.is_current(version, text):
+                result.unchanged.append(version)
+                continue
+            await queue.put((version, text))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        await target.close()
+    return result
+
+
+async def _send_with_retry(target, worker, version, text, retries, backoff):
+    attempt = 0
+    while True:
+        try:
+            await target.send(worker, version, text)
+            return
+        except PublishError as err:
+            if not err.retry or attempt >= retries:
+                raise
+            delay = err.retry_after
+            if delay is None:
+                delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def publish_changelog_sections(
+    target_filename,
+    config_filename,
+    target,
+    state_filename=None,
+    versions=None,
+    concurrency=4,
+    retries=4,
+    force=False,
+):
+    """Publish the sections of a changelog file to ``target``.
+
+    ``state_filename`` names the JSON file of content hashes used to skip
+    sections that haven't changed since they were last sent; it's written
+    back even if some sections failed, so that those that succeeded aren't
+    sent again.  Returns a :class:`.PublishResult`.
+
+    """
+    state = PublishState(state_filename)
+    sections = mdwriter.iter_changelog_sections(
+        target_filename, config_filename, versions=versions
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            publish_sections(
+                sections,
+                target,
+                state,
+                concurrency=concurrency,
+                retries=retries,
+                force=force,
+            )
+        )
+    finally:
+        state.save()
+        loop.close()
+
+
+def publish_to_url(
+    target_filename,
+    config_filename,
+    url,
+    method,
+    headers,
+    state_filename,
+    versions,
+    concurrency,
+    retries,
+    force,
+):
+    """Command line entry point; returns the number of failed sections.
+
+    ``headers`` is a sequence of ``(name, value)`` pairs.
+
+    """
+    target = HTTPTarget(url, method=method, headers=headers)
+    result = publish_changelog_sections(
+        target_filename,
+        config_filename,
+        target,
+        state_filename=state_filename,
+        versions=versions,
+        concurrency=concurrency,
+        retries=retries,
+        force=force,
+    )
+    for version in result.sent:
+        sys.stderr.write("published %s\n" % version)
+    for version, message in result.failed:
+        sys.stderr.write("failed %s: %s\n" % (version, message))
+    sys.stderr.write(
+        "%d sent, %d unchanged, %d failed\n"
+        % (len(result.sent), len(result.unchanged), len(result.failed))
+    )
+    return len(result.failed)
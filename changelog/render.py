@@ -0,0 +1,242 @@
+"""Render the version sections of a changelog file in several formats.
+
+The file is published through docutils once and every format is a walk
+over the same document, so that adding a format costs a traversal rather
+than another parse::
+
+    changelog render doc/build/changelog/changelog_14.rst -c conf.py \\
+        --format md,txt,json,html --out-dir build/release-notes
+
+writes ``<version>.md``, ``<version>.txt`` and so on into the output
+directory for each version; a version with more than one section gets
+them all in one file.  Other formats can be added to :data:`.FORMATS`,
+or passed to :func:`.render_sections` directly.
+
+"""
+import json
+import os
+import sys
+
+from docutils import frontend
+from docutils import nodes
+from docutils import utils
+from docutils.writers import html5_polyglot
+
+from . import mdwriter
+from .environment import DefaultEnvironment
+from .export import record_as_dict
+
+
+class _RenderEnvironment(DefaultEnvironment):
+    def __init__(self, config_filename=None, config=None):
+        super(_RenderEnvironment, self).__init__(
+            config_filename=config_filename, config=config
+        )
+        self.records = {}
+        self._seen = set()
+
+    def note_change_records(self, version, records):
+        # a later section of the same version is handed the records of
+        # the earlier ones again
+        for rec in records:
+            if (version, rec.hash) not in self._seen:
+                self._seen.add((version, rec.hash))
+                self.records.setdefault(version, []).append(
+                    record_as_dict(version, rec)
+                )
+
+
+class Format(object):
+    """A way of writing the version sections of a parsed changelog."""
+
+    #: file extension of the files written, without the dot
+    extension = None
+
+    def render(self, document, changelog_env, versions):
+        """Yield ``(version, text)`` for each version section of
+        ``document`` in document order, or only those in ``versions``."""
+
+        raise NotImplementedError()
+
+
+class MarkdownFormat(Format):
+    extension = "md"
+
+    translator_class = mdwriter.MarkdownTranslator
+
+    def render(self, document, changelog_env, versions):
+        translator = self.translator_class(document, None, None)
+        return translator.iter_version_sections(versions)
+
+
+class TextTranslator(mdwriter.MarkdownTranslator):
+    """Plain text, such as for email, with titles underlined rst-style
+    and link targets written out after their text."""
+
+    underlines = "=-~"
+
+    def visit_strong(self, node):
+        pass
+
+    def depart_strong(self, node):
+        pass
+
+    def visit_emphasis(self, node):
+        pass
+
+    def depart_emphasis(self, node):
+        pass
+
+    def visit_literal(self, node):
+        pass
+
+    def depart_literal(self, node):
+        pass
+
+    def visit_title(self, node):
+        title = node.astext()
+        underline = self.underlines[
+            min(self.section_level, len(self.underlines)) - 1
+        ]
+        self.buf.write("\n%s\n%s\n\n" % (title, underline * len(title)))
+        raise nodes.SkipNode()
+
+    def visit_reference(self, node):
+        if "changelog-reference" in node.attributes["classes"]:
+            self.visit_changeset_link(node)
+
+    def depart_reference(self, node):
+        if "changelog-reference" in node.attributes["classes"]:
+            self.depart_changeset_link(node)
+        elif node.attributes.get("refuri", node.astext()) != node.astext():
+            self.buf.write(" <%s>" % node.attributes["refuri"])
+
+
+class TextFormat(MarkdownFormat):
+    extension = "txt"
+
+    translator_class = TextTranslator
+
+
+class JSONFormat(Format):
+    """The change records of each version, as :func:`.record_as_dict`
+    returns them."""
+
+    extension = "json"
+
+    def render(self, document, changelog_env, versions):
+        translator = mdwriter.MarkdownTranslator(document, None, None)
+        seen = set()
+        for version in translator.version_strings():
+            if versions is not None and version not in versions:
+                continue
+            # the records of all of a version's sections are together
+            if version in seen:
+                continue
+            seen.add(version)
+            yield version, json.dumps(
+                changelog_env.records.get(version, []),
+                ensure_ascii=False,
+                indent=2,
+                sort_keys=True,
+            ) + "\n"
+
+
+class HTMLFormat(Format):
+    """The HTML body of each version section, as docutils' html5 writer
+    renders it."""
+
+    extension = "html"
+
+    def render(self, document, changelog_env, versions):
+        # the document was published with the settings of another writer;
+        # the translator gets a document of its own carrying html settings
+        settings = frontend.OptionParser(
+            components=(html5_polyglot.Writer,)
+        ).get_default_values()
+        settings.report_level = 3
+        html_document = utils.new_document(document["source"], settings)
+
+        translator = mdwriter.MarkdownTranslator(document, None, None)
+        for version_node, walk_node in translator.version_nodes():
+            version = version_node.attributes["version_string"]
+            if versions is not None and version not in versions:
+                continue
+            if walk_node is document:
+                # a section squashed into the document subtitle
+                walk_node = nodes.section(
+                    "",
+                    nodes.title(version, version, classes=["release-version"]),
+                    *[subnode.deepcopy() for subnode in document[2:]],
+                    **version_node.attributes
+                )
+            html_translator = html5_polyglot.HTMLTranslator(html_document)
+            walk_node.walkabout(html_translator)
+            yield version, "".join(html_translator.body)
+
+
+FORMATS = {
+    "md": MarkdownFormat,
+    "txt": TextFormat,
+    "json": JSONFormat,
+    "html": HTMLFormat,
+}
+
+
+def render_sections(target_filename, config_filename, formats, versions=None):
+    """Parse a changelog file once and render it in each of ``formats``.
+
+    ``formats`` are names from :data:`.FORMATS` or :class:`.Format`
+    instances.  Yields ``(format, version, text)`` tuples, format by
+    format, for each version section or only those in ``versions``.
+
+    """
+    formats = [
+        FORMATS[fmt]() if isinstance(fmt, str) else fmt for fmt in formats
+    ]
+
+    changelog_env = _RenderEnvironment(config_filename)
+    changelog_env.render_versions = versions
+    document = mdwriter._publish_doctree(target_filename, changelog_env)
+
+    for fmt in formats:
+        with changelog_env.profiler.span("render format", fmt.extension):
+            for version, text in fmt.render(document, changelog_env, versions):
+                yield fmt, version, text
+
+
+def render_to_directory(
+    target_filename, config_filename, formats, out_dir, versions=None
+):
+    """Command line entry point; writes ``<version>.<extension>`` files.
+
+    ``formats`` is a comma separated string of format names.  The sections
+    of a version with more than one are written one after the other.
+
+    """
+    names = [name.strip() for name in formats.split(",") if name.strip()]
+    unknown = sorted(set(names).difference(FORMATS))
+    if unknown or not names:
+        raise ValueError(
+            "unknown format(s) %s; choose from %s"
+            % (", ".join(unknown) or repr(formats), ", ".join(sorted(FORMATS)))
+        )
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    written = set()
+    for fmt, version, text in render_sections(
+        target_filename, config_filename, names, versions=versions
+    ):
+        output_filename = os.path.join(
+            out_dir, "%s.%s" % (version.replace(os.sep, "_"), fmt.extension)
+        )
+        if output_filename in written:
+            with open(output_filename, "a", encoding="utf-8") as handle:
+                handle.write("\n" + text)
+            continue
+        written.add(output_filename)
+        with open(output_filename, "w", encoding="utf-8") as handle:
+            handle.write(text)
+        sys.stderr.write("%s -> %s\n" % (target_filename, output_filename))
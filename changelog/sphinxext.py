@@ -1,3 +1,4 @@
+import collections
 import os
 
 from sphinx.util import logging
@@ -5,11 +6,14 @@ from sphinx.util import status_iterator
 from sphinx.util.console import bold
 from sphinx.util.osutil import copyfile
 
+from . import cache
+from . import profile
 from .docutils import ChangeDirective
 from .docutils import ChangeLogDirective
 from .docutils import ChangeLogImportDirective
 from .docutils import make_ticket_link
 from .environment import Environment
+from .export import record_hash
 
 
 LOG = logging.getLogger(__name__)
@@ -60,6 +64,38 @@ class SphinxEnvironment(Environment):
     def changelog_render_changeset(self):
         return self.sphinx_env.config.changelog_render_changeset
 
+    @property
+    def changelog_notes_cache_dir(self):
+        cache_dir = self.sphinx_env.config.changelog_notes_cache_dir
+        if cache_dir is None:
+            # keep the cache alongside the pickled doctrees by default
+            return os.path.join(self.sphinx_env.doctreedir, "changelog")
+        return cache_dir
+
+    @property
+    def profiler(self):
+        return getattr(
+            self.sphinx_env, "changelog_profiler", profile.NULL_PROFILER
+        )
+
+    def note_notes_files(self, path, fnames):
+        path = os.path.abspath(path)
+        for fname in fnames:
+            self.sphinx_env.note_dependency(os.path.join(path, fname))
+        _notes_dirs(self.sphinx_env).setdefault(self.sphinx_env.docname, {})[
+            path
+        ] = fnames
+
+    def note_change_records(self, version, records):
+        # the body nodes stay behind; they belong to the doctree and would
+        # otherwise be pickled along with the environment
+        _change_records(self.sphinx_env).setdefault(
+            self.sphinx_env.docname, {}
+        )[version] = [rec.detached() for rec in records]
+
+    def render_version(self, version):
+        return True
+
     def status_iterator(self, elements, message):
         return status_iterator(
             elements,
@@ -70,6 +106,98 @@ class SphinxEnvironment(Environment):
         )
 
 
+def _notes_dirs(env):
+    # {docname: {notes directory: [fragment filenames]}}, persisted with
+    # the pickled environment so that the next build can detect fragments
+    # being added or removed
+    try:
+        return env.changelog_notes_dirs
+    except AttributeError:
+        env.changelog_notes_dirs = {}
+        return env.changelog_notes_dirs
+
+
+def _change_records(env):
+    # {docname: {version: [record, ...]}}
+    try:
+        return env.changelog_change_records
+    except AttributeError:
+        env.changelog_change_records = {}
+        return env.changelog_change_records
+
+
+def change_records(env, version):
+    """Return the change records for a version across all documents.
+
+    Records are collected per document as each one is read, in whichever
+    process read it, and merged into the main environment once reading is
+    done.  A change that was rendered by more than one document, such as
+    one pulled in through ``.. changelog_imports::``, is returned once,
+    deduplicated on :func:`.export.record_hash`.  Documents are visited in
+    sorted order so the result is the same for serial and parallel builds.
+
+    """
+    records = collections.OrderedDict()
+    all_records = _change_records(env)
+    for docname in sorted(all_records):
+        for rec in all_records[docname].get(version, ()):
+            records.setdefault(record_hash(version, rec), rec)
+    return list(records.values())
+
+
+def purge_doc(app, env, docname):
+    _notes_dirs(env).pop(docname, None)
+    _change_records(env).pop(docname, None)
+
+
+def merge_info(app, env, docnames, other):
+    for collection in (_notes_dirs, _change_records):
+        ours = collection(env)
+        theirs = collection(other)
+        for docname in docnames:
+            if docname in theirs:
+                ours[docname] = theirs[docname]
+    if hasattr(env, "changelog_profiler") and hasattr(
+        other, "changelog_profiler"
+    ):
+        env.changelog_profiler.merge(other.changelog_profiler)
+
+
+def start_profile(app, env, docnames):
+    if app.config.changelog_profile_output:
+        env.changelog_profiler = profile.Profiler()
+    elif hasattr(env, "changelog_profiler"):
+        del env.changelog_profiler
+
+
+def write_profile(app, exception):
+    profiler = getattr(app.env, "changelog_profiler", None)
+    if profiler is None or exception:
+        return
+    filename = os.path.join(app.confdir, app.config.changelog_profile_output)
+    profiler.write_chrome_trace(filename)
+    LOG.info(profiler.summary())
+    LOG.info(bold("changelog profile written to %s" % filename))
+
+
+def get_outdated_notes_docs(app, env, added, changed, removed):
+    """Report documents whose notes directories gained or lost files.
+
+    Edits to and removals of existing fragments are already caught by
+    Sphinx, as each fragment is noted as a dependency of the document.
+
+    """
+    outdated = []
+    for docname, notes_dirs in _notes_dirs(env).items():
+        if docname in changed or docname in removed:
+            continue
+        for path, fnames in notes_dirs.items():
+            if cache.list_note_files(path) != fnames:
+                outdated.append(docname)
+                break
+    return outdated
+
+
 def add_stylesheet(app):
     # changed in 1.8 from add_stylesheet()
     # https://www.sphinx-doc.org/en/master/extdev/appapi.html#sphinx.application.Sphinx.add_css_file
@@ -107,8 +235,15 @@ def setup(app):
     app.add_config_value("changelog_render_ticket", None, "env")
     app.add_config_value("changelog_render_pullreq", None, "env")
     app.add_config_value("changelog_render_changeset", None, "env")
+    app.add_config_value("changelog_notes_cache_dir", None, "env")
+    app.add_config_value("changelog_profile_output", None, "")
     app.connect("builder-inited", add_stylesheet)
+    app.connect("env-purge-doc", purge_doc)
+    app.connect("env-merge-info", merge_info)
+    app.connect("env-get-outdated", get_outdated_notes_docs)
+    app.connect("env-before-read-docs", start_profile)
     app.connect("build-finished", copy_stylesheet)
+    app.connect("build-finished", write_profile)
     app.add_role("ticket", make_ticket_link)
 
     return {"parallel_read_safe": True, "parallel_write_safe": True}
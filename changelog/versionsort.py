@@ -0,0 +1,126 @@
+"""Sort keys for changelog version strings.
+
+Replaces ``distutils.version.LooseVersion``; version strings are parsed
+once into plain tuples which compare quickly, and the parse results are
+kept in a bounded cache so long-running processes don't grow without
+limit.
+
+"""
+import functools
+import re
+
+_INF = float("inf")
+
+_PEP440 = re.compile(
+    r"""
+    ^\s*v?
+    (?:(?P<epoch>\d+)!)?
+    (?P<release>\d+(?:\.\d+)*)
+    (?:[-_.]?(?P<pre_l>a|alpha|b|beta|c|rc|pre|preview)[-_.]?(?P<pre_n>\d*))?
+    (?:(?:-(?P<post_n1>\d+))|(?:[-_.]?(?:post|rev|r)[-_.]?(?P<post_n2>\d*)))?
+    (?:[-_.]?dev[-_.]?(?P<dev_n>\d*))?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+_PRE_RANKS = {
+    "a": 0,
+    "alpha": 0,
+    "b": 1,
+    "beta": 1,
+    "c": 2,
+    "rc": 2,
+    "pre": 2,
+    "preview": 2,
+}
+
+_LOOSE_COMPONENT = re.compile(r"(\d+|[a-z]+|\.)", re.IGNORECASE)
+
+
+# where the text after the leading numbers of a non-PEP 440 version sorts
+# among pre-releases; after development releases, before alphas
+_LOOSE_RANK = -1
+
+
+@functools.lru_cache(maxsize=4096)
+def version_key(version):
+    """Return a sort key for a version string.
+
+    PEP 440 versions sort as PEP 440 specifies, so that
+    ``1.4.0.dev1 < 1.4.0b1 < 1.4.0rc1 < 1.4.0 == 1.4 < 1.4.0.post1``.
+    Anything else sorts by its leading numbers as a release, and then by
+    the numeric and alphabetic runs of the rest of the string, which is
+    what ``LooseVersion`` compared; so ``1.3.9 < 1.4.x < 1.4.0a1``.
+
+    """
+    m = _PEP440.match(version)
+    if m is None:
+        return _loose_key(version)
+
+    release = _release(int(part) for part in m.group("release").split("."))
+
+    pre_l = m.group("pre_l")
+    post = m.group("post_n1") or m.group("post_n2")
+    has_post = m.group("post_n1") is not None or m.group("post_n2") is not None
+    dev = m.group("dev_n")
+    has_dev = dev is not None
+
+    if pre_l is not None:
+        pre = (_PRE_RANKS[pre_l.lower()], int(m.group("pre_n") or 0))
+    elif has_dev and not has_post:
+        # 1.4.dev1 sorts before 1.4a1
+        pre = (-_INF, 0)
+    else:
+        pre = (_INF, 0)
+
+    local = m.group("local")
+    if local is None:
+        local = ()
+    else:
+        local = _loose_components(local)
+
+    return (
+        int(m.group("epoch") or 0),
+        release,
+        pre,
+        int(post or 0) if has_post else -_INF,
+        int(dev or 0) if has_dev else _INF,
+        local,
+    )
+
+
+def _release(numbers):
+    release = tuple(numbers)
+    # trailing zeroes don't count; 1.4 == 1.4.0
+    while len(release) > 1 and release[-1] == 0:
+        release = release[:-1]
+    return release
+
+
+def _loose_key(version):
+    components = list(_loose_components(version))
+    if components and components[0] == (0, "v"):
+        components.pop(0)
+    numbers = []
+    while components and components[0][0] == 1:
+        numbers.append(components.pop(0)[1])
+    return (
+        0,
+        _release(numbers),
+        (_LOOSE_RANK, tuple(components)),
+        -_INF,
+        _INF,
+        (),
+    )
+
+
+def _loose_components(version):
+    # numbers and words compare among themselves; numbers sort after words
+    # so that "1.0b1" < "1.0.1", as they would under PEP 440
+    return tuple(
+        (1, int(part)) if part.isdigit() else (0, part.lower())
+        for part in _LOOSE_COMPONENT.findall(version)
+        if part != "."
+    )
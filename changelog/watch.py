@@ -0,0 +1,396 @@
+"""Re-render a changelog as it's edited.
+
+Watches a changelog file, the ``:include_notes_from:`` directories of
+its version blocks, the files pulled in by ``.. changelog_imports::`` and
+the config file.  After each burst of changes, only the versions whose
+sections may render differently are re-rendered, using the same
+per-version keys as the output cache; the config stays loaded and the
+imported files stay parsed between edits.  An edit to an imported file
+or to the config re-renders every version::
+
+    changelog watch doc/build/changelog/changelog_14.rst -c conf.py \\
+        -v 1.4.1 -o build/unreleased.md
+
+Uses inotify on Linux, and polls file stats elsewhere.
+
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import tempfile
+import time
+
+from . import cache
+from . import mdwriter
+from .blocks import split_version_blocks
+from .environment import DefaultEnvironment
+from .environment import load_config
+
+# struct inotify_event, followed by a name of "len" bytes
+_EVENT = struct.Struct("iIII")
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+
+
+class PollingWatcher(object):
+    """Notice changes by comparing file stats every ``interval`` seconds.
+
+    Like :class:`.InotifyWatcher`, watches directories, reporting the
+    paths of the files in them that were changed, added or removed.
+
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.directories = set()
+        self._snapshot = {}
+
+    def watch(self, directories):
+        self.directories = set(directories)
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                fnames = os.listdir(directory)
+            except OSError:
+                continue
+            for fname in fnames:
+                path = os.path.join(directory, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """Return the set of paths changed, waiting up to ``timeout``
+        seconds, or indefinitely, for there to be any."""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changed = set(
+                path
+                for path in set(snapshot).union(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path)
+            )
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return changed
+                time.sleep(min(self.interval, remaining))
+            else:
+                time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Notice changes through Linux inotify.
+
+    Directories are watched rather than files, so that files replaced by
+    an editor renaming a new file over them are still followed.
+
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._directories = {}
+
+    def watch(self, directories):
+        directories = set(directories)
+        for wd, directory in list(self._directories.items()):
+            if directory not in directories:
+                self._rm_watch(self.fd, wd)
+                del self._directories[wd]
+        known = set(self._directories.values())
+        for directory in directories.difference(known):
+            wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    # reported when the file is parsed
+                    continue
+                raise OSError(err, os.strerror(err), directory)
+            self._directories[wd] = directory
+
+    def wait(self, timeout=None):
+        """Return the set of paths changed, waiting up to ``timeout``
+        seconds, or indefinitely, for there to be any."""
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos : pos + length].rstrip(b"\0")
+            pos += length
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                # the directory itself went away
+                changed.add(directory)
+                del self._directories[wd]
+            elif name:
+                changed.add(os.path.join(directory, os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(poll=False, interval=0.5):
+    """Return an :class:`.InotifyWatcher` if inotify is available and
+    ``poll`` isn't set, else a :class:`.PollingWatcher`."""
+
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(interval)
+
+
+class ChangelogWatch(object):
+    """Keep the rendered sections of a changelog file up to date.
+
+    :meth:`.update` re-reads the file and its notes, and re-renders the
+    versions whose key changed since the last update, as computed by
+    :func:`.cache.section_keys`.  The keys don't cover the files read in
+    by ``.. include::`` directives or the config file; these are recorded
+    with their :func:`.cache.dependency_digest` at each render, and all
+    versions are rendered again when one of them changes.
+
+    """
+
+    def __init__(self, target_filename, config_filename, versions=None):
+        self.target_filename = target_filename
+        self.config_filename = config_filename
+        self.versions = versions
+        self.keys = {}
+        self.sections = []
+        self.notes_dirs = set()
+        # {absolute path: digest} of the included files and the config
+        # file as of the last render
+        self.dependencies = {}
+        self._load_config()
+
+    def _load_config(self):
+        self.config = load_config(self.config_filename)
+        self.config_key = cache.config_key(
+            DefaultEnvironment(config=self.config)
+        )
+
+    def directories(self):
+        """The directories to watch."""
+
+        return (
+            set([os.path.dirname(os.path.abspath(self.target_filename))])
+            .union(self.notes_dirs)
+            .union(os.path.dirname(path) for path in self.dependencies)
+        )
+
+    def is_relevant(self, path):
+        if path == os.path.abspath(self.target_filename):
+            return True
+        if path in self.notes_dirs or path in self.dependencies:
+            return True
+        return os.path.dirname(path) in self.notes_dirs and path.endswith(
+            ".rst"
+        )
+
+    def update(self):
+        """Re-render what changed; returns the list of versions rendered."""
+
+        if any(
+            cache.dependency_digest(path) != digest
+            for path, digest in self.dependencies.items()
+        ):
+            self._load_config()
+            self.keys = {}
+
+        with open(self.target_filename, encoding="utf-8") as handle:
+            text = handle.read()
+        blocks, lines = split_version_blocks(text)
+        base, keys, self.notes_dirs = cache.section_keys(
+            self.config_key,
+            blocks,
+            lines,
+            os.path.dirname(self.target_filename),
+        )
+        wanted = [
+            block.version
+            for block in blocks
+            if self.versions is None or block.version in self.versions
+        ]
+        # versions without a key, having more than one section, are
+        # rendered every time
+        stale = set(
+            version
+            for version in wanted
+            if version not in keys or keys[version] != self.keys.get(version)
+        )
+        if not stale and [version for version, _ in self.sections] == wanted:
+            return []
+
+        rendered = dict(self.sections)
+        fresh = []
+        if stale:
+            changelog_env = DefaultEnvironment(config=self.config)
+            dependencies = []
+            for version, section_text in mdwriter._iter_published_sections(
+                self.target_filename,
+                changelog_env,
+                sorted(stale),
+                dependencies,
+            ):
+                fresh.append((version, section_text))
+            if self.config_filename is not None:
+                dependencies.append(self.config_filename)
+            self.dependencies = dict(
+                (os.path.abspath(path), cache.dependency_digest(path))
+                for path in dependencies
+            )
+        # sections are kept in document order; a version with several
+        # sections shows up several times
+        fresh_sections = {}
+        for version, section_text in fresh:
+            fresh_sections.setdefault(version, []).append(section_text)
+        sections = []
+        for version in wanted:
+            if version in fresh_sections and fresh_sections[version]:
+                sections.append((version, fresh_sections[version].pop(0)))
+            elif version in rendered:
+                sections.append((version, rendered[version]))
+        self.sections = sections
+        self.keys = keys
+        return [version for version, _ in fresh]
+
+
+def _write_output(output, sections):
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            for version, text in sections:
+                handle.write(text + "\n")
+        os.replace(tmpname, output)
+    except:  # noqa
+        os.unlink(tmpname)
+        raise
+
+
+def watch_changelog(
+    target_filename,
+    config_filename,
+    versions=None,
+    output=None,
+    debounce=0.2,
+    poll=False,
+    interval=0.5,
+):
+    """Command line entry point; runs until interrupted.
+
+    Sections are written as ``generate-md -s`` writes them, to ``output``
+    in full on each change, or else only the re-rendered ones to stdout.
+    Errors, such as those of a half-written file, are reported and
+    watching goes on.
+
+    """
+    watched = ChangelogWatch(target_filename, config_filename, versions)
+    watcher = make_watcher(poll=poll, interval=interval)
+    sys.stderr.write(
+        "watching %s with %s\n"
+        % (target_filename, type(watcher).__name__.replace("Watcher", ""))
+    )
+    try:
+        while True:
+            try:
+                rendered = watched.update()
+            except Exception as err:
+                sys.stderr.write(
+                    "%s: %s: %s\n" % (target_filename, type(err).__name__, err)
+                )
+            else:
+                if rendered:
+                    _report(watched, rendered, output)
+            watcher.watch(watched.directories())
+
+            # wait for a change that matters, then for things to settle
+            while True:
+                changed = watcher.wait()
+                if any(watched.is_relevant(path) for path in changed):
+                    break
+            while watcher.wait(debounce):
+                pass
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
+
+
+def _report(watched, rendered, output):
+    if output is not None:
+        _write_output(output, watched.sections)
+        sys.stderr.write(
+            "%s: rendered %s into %s\n"
+            % (watched.target_filename, ", ".join(rendered), output)
+        )
+        return
+    for version, text in watched.sections:
+        if version in rendered:
+            sys.stdout.write(text + "\n")
+    sys.stdout.flush()
+    sys.stderr.write(
+        "%s: rendered %s\n" % (watched.target_filename, ", ".join(rendered))
+    )
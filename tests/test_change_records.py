@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+application = pytest.importorskip("sphinx.application")
+sphinx_docutils = pytest.importorskip("sphinx.util.docutils")
+
+from changelog.export import record_hash  # noqa: E402
+from changelog.sphinxext import change_records  # noqa: E402
+
+IMPORTED = """\
+.. changelog::
+    :version: 1.3.1
+    :released: Jan 1 2020
+
+    .. change::
+        :tags: orm
+        :tickets: 77
+        :versions: 1.4.1
+
+        Backported fix.
+"""
+
+DOCUMENT = """\
+%(title)s
+%(underline)s
+
+.. changelog_imports::
+
+    .. include:: changelog_13.rst
+
+.. changelog::
+    :version: 1.4.1
+    :released: Feb 1 2020
+
+    .. change::
+        :tags: %(tag)s
+        :tickets: %(ticket)d
+
+        Change from %(title)s.
+"""
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / "conf.py").write_text(
+        'extensions = ["changelog"]\n'
+        'changelog_sections = ["general", "orm"]\n'
+        'master_doc = "index"\n'
+        'exclude_patterns = ["changelog_13.rst", "_build"]\n'
+    )
+    (tmp_path / "changelog_13.rst").write_text(IMPORTED)
+    docnames = ["doc%d" % i for i in range(8)]
+    (tmp_path / "index.rst").write_text(
+        "Index\n=====\n\n.. toctree::\n\n%s\n"
+        % "\n".join("    %s" % docname for docname in docnames)
+    )
+    for i, docname in enumerate(docnames):
+        (tmp_path / ("%s.rst" % docname)).write_text(
+            DOCUMENT
+            % {
+                "title": docname,
+                "underline": "=" * len(docname),
+                "tag": ("general", "orm")[i % 2],
+                "ticket": 100 + i,
+            }
+        )
+    return tmp_path
+
+
+def _records(project, parallel):
+    build = project / ("_build%d" % parallel)
+    # keep the directives and roles Sphinx registers with docutils from
+    # leaking into the other tests
+    with sphinx_docutils.docutils_namespace():
+        app = application.Sphinx(
+            str(project),
+            str(project),
+            str(build / "html"),
+            str(build / "doctrees"),
+            "html",
+            status=None,
+            warning=io.StringIO(),
+            freshenv=True,
+            parallel=parallel,
+        )
+        app.build(force_all=True)
+    return [
+        (record_hash("1.4.1", rec), sorted(rec.tickets), rec.node)
+        for rec in change_records(app.env, "1.4.1")
+    ]
+
+
+def test_parallel_build_merges_records(project):
+    serial = _records(project, 1)
+    # one change per document, plus the imported one only once
+    assert len(serial) == 9
+    assert sorted(tickets for _, tickets, _ in serial) == sorted(
+        [["77"]] + [[str(100 + i)] for i in range(8)]
+    )
+    assert all(node is None for _, _, node in serial)
+
+    assert _records(project, 4) == serial
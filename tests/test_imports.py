@@ -0,0 +1,54 @@
+import io
+
+from changelog.environment import DefaultEnvironment
+from changelog.mdwriter import _render_changelog_as_md
+
+IMPORTED = """\
+.. changelog::
+    :version: 1.3.1
+    :released: Jan 1 2020
+
+    .. change::
+        :tags: orm
+        :tickets: 77
+        :versions: 1.4.1, 1.5.1
+
+        Backported, see `the docs <baz_>`_ here.
+
+        .. _baz: http://example.com/baz
+"""
+
+IMPORTING = """\
+=========
+Changelog
+=========
+
+.. changelog_imports::
+
+    .. include:: changelog_13.rst
+
+.. changelog::
+    :version: %s
+    :released: Feb 1 2020
+"""
+
+
+def _render(path):
+    destination = io.StringIO()
+    _render_changelog_as_md(
+        str(path),
+        DefaultEnvironment(config={"changelog_sections": ["orm"]}),
+        None,
+        True,
+        destination,
+    )
+    return destination.getvalue()
+
+
+def test_imported_named_reference(tmp_path, capsys):
+    (tmp_path / "changelog_13.rst").write_text(IMPORTED)
+    for version in ("1.4.1", "1.5.1"):
+        path = tmp_path / ("changelog_%s.rst" % version)
+        path.write_text(IMPORTING % version)
+        assert "[the docs](http://example.com/baz)" in _render(path)
+    assert "Unknown target name" not in capsys.readouterr().err
@@ -0,0 +1,125 @@
+import io
+import os
+
+import pytest
+
+from changelog.environment import DefaultEnvironment
+from changelog.mdwriter import _render_changelog_as_md
+
+CHANGELOG = """\
+=========
+Changelog
+=========
+
+.. changelog::
+    :version: 1.1.0
+    :include_notes_from: unreleased
+
+.. changelog::
+    :version: 1.0.0
+    :released: Jan 1 2020
+
+    .. change::
+        :tags: orm
+        :tickets: 5
+
+        Old thing.
+"""
+
+NAMED_REFERENCE = """\
+.. change::
+    :tags: orm
+    :tickets: 7
+
+    See `the docs <bar_>`_ for details.
+
+    .. _bar: http://example.com/bar
+"""
+
+PLAIN = """\
+.. change::
+    :tags: general
+
+    A plain change.
+"""
+
+
+@pytest.fixture
+def project(tmp_path):
+    notes = tmp_path / "unreleased"
+    notes.mkdir()
+    (notes / "1.rst").write_text(NAMED_REFERENCE)
+    (notes / "2.rst").write_text(PLAIN)
+    (tmp_path / "changelog.rst").write_text(CHANGELOG)
+    return tmp_path
+
+
+def _render(project):
+    changelog_env = DefaultEnvironment(
+        config={
+            "changelog_sections": ["general", "orm"],
+            "changelog_notes_cache_dir": str(project / "cache"),
+        }
+    )
+    destination = io.StringIO()
+    _render_changelog_as_md(
+        str(project / "changelog.rst"), changelog_env, None, True, destination
+    )
+    return destination.getvalue()
+
+
+def test_warm_build_resolves_named_reference(project, capsys):
+    cold = _render(project)
+    assert "[the docs](http://example.com/bar)" in cold
+    assert os.listdir(str(project / "cache"))
+
+    warm = _render(project)
+    assert warm == cold
+    assert "Unknown target name" not in capsys.readouterr().err
+
+
+def test_warm_build_warns_of_tabs(project):
+    (project / "unreleased" / "2.rst").write_text(PLAIN.replace("    ", "\t"))
+    with pytest.warns(UserWarning, match="2.rst"):
+        _render(project)
+    with pytest.warns(UserWarning, match="2.rst"):
+        _render(project)
+
+
+def test_sphinx_warm_build_resolves_named_reference(project):
+    application = pytest.importorskip("sphinx.application")
+    sphinx_docutils = pytest.importorskip("sphinx.util.docutils")
+
+    (project / "conf.py").write_text(
+        'extensions = ["changelog"]\n'
+        'changelog_sections = ["general", "orm"]\n'
+        'master_doc = "changelog"\n'
+        'exclude_patterns = ["unreleased", "_build"]\n'
+    )
+    outdir = project / "_build" / "html"
+    doctreedir = project / "_build" / "doctrees"
+
+    def build():
+        # keep the directives and roles Sphinx registers with docutils
+        # from leaking into the other tests
+        with sphinx_docutils.docutils_namespace():
+            app = application.Sphinx(
+                str(project),
+                str(project),
+                str(outdir),
+                str(doctreedir),
+                "html",
+                status=None,
+                warning=io.StringIO(),
+                freshenv=True,
+            )
+            app.build(force_all=True)
+        return app._warning.getvalue()
+
+    for _ in range(2):
+        warnings = build()
+        html = (outdir / "changelog.html").read_text()
+        assert 'href="http://example.com/bar"' in html
+        assert "bar_" not in html
+        assert "Unknown target name" not in warnings
+    assert os.listdir(str(doctreedir / "changelog"))
@@ -0,0 +1,112 @@
+import asyncio
+import http.server
+import json
+import threading
+
+import pytest
+
+from changelog import publish
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        version = body["version"]
+        with server.lock:
+            server.attempts[version] = server.attempts.get(version, 0) + 1
+            attempt = server.attempts[version]
+        status = server.statuses.get(version, [200])
+        status = status[min(attempt, len(status)) - 1]
+        if status == 200:
+            with server.lock:
+                server.received[version] = (body["body"], dict(self.headers))
+        self.send_response(status)
+        if status == 503:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.attempts = {}
+    server.received = {}
+    server.statuses = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _publish(sections, target, state, **kw):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            asyncio.wait_for(
+                publish.publish_sections(sections, target, state, **kw), 10
+            )
+        )
+    finally:
+        loop.close()
+
+
+def test_sends_and_retries(server, tmp_path):
+    server.statuses["1.1"] = [503, 503, 200]
+    server.statuses["1.2"] = [404]
+    target = publish.HTTPTarget(
+        "http://127.0.0.1:%d/releases/{version}" % server.server_port,
+        method="PUT",
+        headers=[("Authorization", "token abc")],
+    )
+    state = publish.PublishState(str(tmp_path / "state.json"))
+    sections = [("1.0", "one"), ("1.1", "two"), ("1.2", "three")]
+
+    result = _publish(sections, target, state, concurrency=2, backoff=0)
+
+    assert sorted(result.sent) == ["1.0", "1.1"]
+    assert [version for version, message in result.failed] == ["1.2"]
+    assert "HTTP 404" in result.failed[0][1]
+    assert server.attempts == {"1.0": 1, "1.1": 3, "1.2": 1}
+    assert server.received["1.1"][0] == "two"
+    assert server.received["1.0"][1]["Authorization"] == "token abc"
+
+    # only what failed or changed is sent again
+    state.save()
+    state = publish.PublishState(str(tmp_path / "state.json"))
+    server.statuses["1.2"] = [200]
+    sections[0] = ("1.0", "one, changed")
+    result = _publish(sections, target, state, backoff=0)
+    assert sorted(result.sent) == ["1.0", "1.2"]
+    assert result.unchanged == ["1.1"]
+
+
+class _BrokenTarget(publish.Target):
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, worker, version, text):
+        if version.endswith("3"):
+            raise RuntimeError("formatter blew up")
+        self.sent.append(version)
+
+
+def test_unexpected_error_fails_section(tmp_path):
+    target = _BrokenTarget()
+    state = publish.PublishState(None)
+    sections = [("1.%d" % num, "text") for num in range(10)]
+
+    result = _publish(sections, target, state, concurrency=1)
+
+    assert result.failed == [("1.3", "RuntimeError: formatter blew up")]
+    assert len(result.sent) == 9
+    assert target.sent == result.sent
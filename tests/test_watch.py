@@ -0,0 +1,68 @@
+import os
+
+from changelog.watch import ChangelogWatch
+
+IMPORTED = """\
+.. changelog::
+    :version: 1.3.1
+    :released: Jan 1 2020
+
+    .. change::
+        :tags: orm
+        :tickets: 77
+        :versions: 1.4.1
+
+        Backported fix.
+"""
+
+CHANGELOG = """\
+=========
+Changelog
+=========
+
+.. changelog_imports::
+
+    .. include:: changelog_13.rst
+
+.. changelog::
+    :version: 1.4.1
+    :released: Feb 1 2020
+
+    .. change::
+        :tags: general
+
+        Other fix.
+"""
+
+
+def _sections(watched):
+    return "\n".join(text for version, text in watched.sections)
+
+
+def test_imported_file_and_config_are_watched(tmp_path):
+    (tmp_path / "changelog_13.rst").write_text(IMPORTED)
+    (tmp_path / "changelog_14.rst").write_text(CHANGELOG)
+    (tmp_path / "conf.py").write_text('changelog_sections = ["general"]\n')
+
+    watched = ChangelogWatch(
+        str(tmp_path / "changelog_14.rst"), str(tmp_path / "conf.py")
+    )
+    assert watched.update() == ["1.4.1"]
+    assert "Backported fix." in _sections(watched)
+    assert watched.is_relevant(str(tmp_path / "changelog_13.rst"))
+    assert watched.is_relevant(str(tmp_path / "conf.py"))
+    assert str(tmp_path) in watched.directories()
+    assert watched.update() == []
+
+    (tmp_path / "changelog_13.rst").write_text(
+        IMPORTED.replace("Backported fix.", "Backported, edited fix.")
+    )
+    assert watched.update() == ["1.4.1"]
+    assert "Backported, edited fix." in _sections(watched)
+
+    (tmp_path / "conf.py").write_text(
+        'changelog_sections = ["general", "orm"]\n'
+    )
+    assert watched.update() == ["1.4.1"]
+    assert "orm" in _sections(watched)
+    assert os.path.abspath(str(tmp_path / "conf.py")) in watched.dependencies